@@ -0,0 +1,146 @@
+"""Memory benchmark of the compact graph mode of MozartPianoGraphDataset.
+
+Builds the augmented corpus graph from piece CSVs, as ``entity_classify.py`` does,
+with int64 ids and float32 features, and in the compact mode with int32 ids and
+float16 / bfloat16 features, each in a fresh process, and reports:
+
+- graph_mb : the bytes of the node data and of the edge id arrays of the graph
+- inverse_mb : the part of graph_mb in the id arrays of the inverse relations. They are copies of the
+  forward arrays in every mode, so the compact mode only halves them with int32 ids
+- resident_mb : the growth of the resident memory after building the graph and one RGCN forward
+- peak_rss_mb : the peak resident memory of the process
+- cache_mb : the size of the cached graph file
+
+The corpus is synthetic by default, written as CSVs under the names of ``PIECE_LIST``,
+or the piece CSVs at ``--url``, e.g. the url of ``MPGD_cad``.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import gc
+import json
+import multiprocessing as mp
+import os, sys
+import resource
+import tempfile
+import time
+import torch as th
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT, 'models', 'rgcn-hetero')))
+
+from utils.nc_dataset_class import MozartPianoGraphDataset, PIECE_LIST
+from benchmarks.synthetic import write_csv_corpus
+from entity_classify import RGCN
+
+
+def resident_mb():
+    """
+    The current resident memory, from /proc on Linux and the peak elsewhere.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def edge_nbytes(g, etypes):
+    """
+    The bytes of the (source, destination) id arrays of the relations ``etypes``.
+    """
+    id_size = 4 if g.idtype == th.int32 else 8
+    return sum(2 * id_size * g.num_edges(etype) for etype in etypes)
+
+
+def graph_nbytes(g):
+    """
+    The bytes of the node data and of the (source, destination) id arrays of every relation.
+    """
+    nbytes = sum(g.nodes[nt].data[k].element_size() * g.nodes[nt].data[k].numel() for nt in g.ntypes for k in g.nodes[nt].data)
+    return nbytes + edge_nbytes(g, g.canonical_etypes)
+
+
+def run_case(url, save_dir, compact, config):
+    """
+    Build the corpus graph in the given mode and measure its memory. Runs in its own process.
+    """
+    if config["threads"] > 0:
+        th.set_num_threads(config["threads"])
+    rss0 = resident_mb()
+    t0 = time.time()
+    dataset = MozartPianoGraphDataset(
+        "bench", url=url, raw_dir=save_dir, save_dir=save_dir,
+        add_inverse_edges=config["add_inverse_edges"], compact=compact, num_workers=config["num_workers"], force_reload=True)
+    g = dataset[0]
+    build_s = time.time() - t0
+    model = RGCN(g.nodes['note'].data['feature'].shape[1], config["n_hidden"], 2, g.etypes)
+    with th.no_grad():
+        model(g, {nt: g.nodes[nt].data['feature'] for nt in g.ntypes})
+    gc.collect()
+    return {
+        "compact": compact, "notes": int(g.num_nodes('note')), "edges": int(g.num_edges()), "build_s": build_s,
+        "graph_mb": graph_nbytes(g) / 1024 ** 2,
+        "inverse_mb": edge_nbytes(g, [e for e in g.canonical_etypes if e[1].endswith("_inv")]) / 1024 ** 2, "resident_mb": resident_mb() - rss0,
+        "peak_rss_mb": peak_rss_mb(), "cache_mb": os.path.getsize(dataset.graph_path) / 1024 ** 2}
+
+
+def main(args):
+    config = {"add_inverse_edges": args.add_inverse_edges, "n_hidden": args.n_hidden, "threads": args.threads,
+              "num_workers": args.num_workers}
+    ctx = mp.get_context('fork' if hasattr(os, 'fork') else 'spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url
+        if url is None:
+            url = os.path.join(tmp, "corpus")
+            write_csv_corpus(url, PIECE_LIST, args.notes_per_piece)
+        results = []
+        # A fresh process per mode, so that the memory belongs to that mode only.
+        for compact in [None, "float16", "bfloat16"]:
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_case, (url, os.path.join(tmp, "cache"), compact, config))
+            print(json.dumps(result))
+            results.append(result)
+    base = results[0]
+    for result in results[1:]:
+        print("{:>9} | graph {:.2f}x smaller | resident {:.2f}x smaller | cache {:.2f}x smaller".format(
+            result["compact"], base["graph_mb"] / result["graph_mb"],
+            base["resident_mb"] / max(result["resident_mb"], 1e-6), base["cache_mb"] / result["cache_mb"]))
+        if base["inverse_mb"] > 0:
+            # the inverse relations are stored like the forward ones, only the id type changes
+            print("{:>9} | inverse relations {:.2f} MB, {:.2f} MB with int64 ids | graph without them {:.2f}x smaller".format(
+                result["compact"], result["inverse_mb"], base["inverse_mb"],
+                (base["graph_mb"] - base["inverse_mb"]) / (result["graph_mb"] - result["inverse_mb"])))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"config": dict(config, url=args.url, notes_per_piece=args.notes_per_piece),
+                       "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact graph memory benchmark')
+    parser.add_argument("--url", type=str, default=None,
+            help="the location of the piece CSVs of PIECE_LIST, default: a synthetic corpus")
+    parser.add_argument("--notes-per-piece", type=int, default=5000,
+            help="number of notes of every synthetic piece")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the pieces in parallel")
+    parser.add_argument("--add-inverse-edges", default=False, action='store_true',
+            help="add the inverse relations")
+    parser.add_argument("--n-hidden", type=int, default=16,
+            help="number of hidden units")
+    parser.add_argument("--threads", type=int, default=0,
+            help="torch intra-op threads, default: 0 [torch default]")
+    parser.add_argument("--output", type=str, default=None,
+            help="JSON output file")
+    args = parser.parse_args()
+    print(args)
+    main(args)
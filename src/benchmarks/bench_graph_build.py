@@ -0,0 +1,65 @@
+"""Benchmark of the corpus graph construction of MozartPianoGraphDataset.
+
+Compares the former pairwise accumulation, which re-batches the whole graph
+built so far for every piece, with collecting the piece graphs and batching once.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import os, sys
+import time
+import dgl
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from utils.nc_dataset_class import piece_graph
+from benchmarks.synthetic import synthetic_corpus
+
+
+def pairwise_build(pieces):
+    graph = piece_graph(pieces[0])
+    for piece in pieces[1:]:
+        graph = dgl.batch([graph, piece_graph(piece)])
+    return graph
+
+
+def single_pass_build(pieces):
+    return dgl.batch([piece_graph(piece) for piece in pieces])
+
+
+def main(args):
+    print("{:>8} | {:>12} | {:>12} | {:>14} | {:>14}".format(
+        "pieces", "pairwise (s)", "single (s)", "pairwise/piece", "single/piece"))
+    for size in args.sizes:
+        pieces = synthetic_corpus(size, args.notes_per_piece, add_inverse_edges=args.add_inverse_edges)
+        t0 = time.time()
+        if size <= args.max_pairwise:
+            pairwise = pairwise_build(pieces)
+            t1 = time.time()
+        else:
+            pairwise, t1 = None, float('nan')
+        t2 = time.time()
+        single = single_pass_build(pieces)
+        t3 = time.time()
+        if pairwise is not None:
+            assert pairwise.num_nodes('note') == single.num_nodes('note')
+            assert all(pairwise.num_edges(et) == single.num_edges(et) for et in single.canonical_etypes)
+        print("{:>8} | {:>12.4f} | {:>12.4f} | {:>14.6f} | {:>14.6f}".format(
+            size, t1 - t0, t3 - t2, (t1 - t0) / size, (t3 - t2) / size))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Graph build benchmark')
+    parser.add_argument("--sizes", type=int, nargs='+', default=[8, 16, 32, 64, 128, 256],
+            help="corpus sizes in pieces")
+    parser.add_argument("--notes-per-piece", type=int, default=1000,
+            help="number of notes of every synthetic piece")
+    parser.add_argument("--max-pairwise", type=int, default=256,
+            help="skip the pairwise build above this corpus size")
+    parser.add_argument("--add-inverse-edges", default=False, action='store_true',
+            help="add the inverse relations")
+    args = parser.parse_args()
+    print(args)
+    main(args)
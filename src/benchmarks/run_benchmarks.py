@@ -0,0 +1,162 @@
+"""Offline benchmark suite for the dataset build and the RGCN model.
+
+For every corpus size, a synthetic corpus is generated and the following are timed
+in a fresh process, together with its peak resident memory:
+
+- build : ``MozartPianoGraphDataset`` processing of the corpus CSVs (parsing, graph construction,
+  batching and saving the cache)
+- load : loading the cached corpus graph
+- forward_backward : one full-graph RGCN forward and backward pass
+- epoch : one epoch over batches of piece graphs with an optimizer step per batch
+- inference : no-grad forwards over batches of piece graphs
+
+Results are written as JSON so that runs can be compared across commits.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os, sys
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import numpy as np
+import torch as th
+import torch.nn.functional as F
+import dgl
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT, 'models', 'rgcn-hetero')))
+
+from utils.nc_dataset_class import MozartPianoGraphDataset
+from benchmarks.synthetic import write_csv_corpus
+from entity_classify import RGCN, run_piece_batches
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def timed(fn, repeat=1):
+    """
+    The mean wall time of ``repeat`` calls of ``fn`` after a warm-up call, and its last result.
+    """
+    result = fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        result = fn()
+        times.append(time.time() - t0)
+    return float(np.mean(times)), result
+
+
+def run_case(num_notes, config):
+    """
+    Time every stage on a corpus of ``num_notes`` notes. Runs in its own process.
+    """
+    if config["threads"] > 0:
+        th.set_num_threads(config["threads"])
+    n_pieces = max(num_notes // config["notes_per_piece"], 1)
+    result = {"notes": num_notes, "pieces": n_pieces}
+    with tempfile.TemporaryDirectory() as tmp:
+        # every piece folder of a raw_dir named 'mozart' is read, so the corpus is not limited to PIECE_LIST
+        corpus = os.path.join(tmp, "mozart")
+        write_csv_corpus(corpus, ["piece{:05d}".format(i) for i in range(n_pieces)], max(num_notes // n_pieces, 1))
+
+        def load(force_reload):
+            return MozartPianoGraphDataset(
+                "bench", url=corpus, raw_dir=corpus, save_dir=os.path.join(tmp, "cache"),
+                add_inverse_edges=config["add_inverse_edges"], num_workers=config["num_workers"], force_reload=force_reload)
+        t0 = time.time()
+        load(True)
+        result["build_s"] = time.time() - t0
+        t0 = time.time()
+        g = load(False)[0]
+        result["load_s"] = time.time() - t0
+    result["edges"] = int(g.num_edges())
+    graphs = dgl.unbatch(g)
+
+    in_feats = g.nodes['note'].data['feature'].shape[1]
+    model = RGCN(in_feats, config["n_hidden"], 2, g.etypes, num_hidden_layers=config["n_layers"] - 2)
+    optimizer = th.optim.Adam(model.parameters(), lr=1e-2)
+    node_features = {nt: g.nodes[nt].data['feature'] for nt in g.ntypes}
+    labels = g.nodes['note'].data['labels']
+
+    def forward_backward():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(model(g, node_features)['note'], labels)
+        loss.backward()
+        optimizer.step()
+    result["forward_backward_s"], _ = timed(forward_backward, config["repeat"])
+
+    loader = dgl.dataloading.GraphDataLoader(graphs, batch_size=config["piece_batch_size"], shuffle=True)
+    model.train()
+    result["epoch_s"], _ = timed(lambda: run_piece_batches(model, loader, 'note', 'cpu', optimizer), config["repeat"])
+    model.eval()
+    result["inference_s"], _ = timed(lambda: run_piece_batches(model, loader, 'note', 'cpu'), config["repeat"])
+    result["inference_notes_per_s"] = num_notes / result["inference_s"]
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+        "torch": th.__version__, "dgl": dgl.__version__, "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def main(args):
+    config = {
+        "notes_per_piece": args.notes_per_piece, "n_hidden": args.n_hidden, "n_layers": args.n_layers,
+        "piece_batch_size": args.piece_batch_size, "add_inverse_edges": args.add_inverse_edges,
+        "repeat": args.repeat, "threads": args.threads, "num_workers": args.num_workers}
+    results = []
+    # A fresh process per size, so that the peak RSS belongs to that size only.
+    ctx = mp.get_context('fork' if hasattr(os, 'fork') else 'spawn')
+    for num_notes in args.sizes:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_case, (num_notes, config))
+        print(json.dumps(result))
+        results.append(result)
+    report = {"meta": metadata(), "config": config, "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark suite')
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+            help="corpus sizes in notes, up to 10M")
+    parser.add_argument("--notes-per-piece", type=int, default=5000,
+            help="number of notes of every synthetic piece")
+    parser.add_argument("--n-hidden", type=int, default=16,
+            help="number of hidden units")
+    parser.add_argument("--n-layers", type=int, default=2,
+            help="number of propagation rounds")
+    parser.add_argument("--piece-batch-size", type=int, default=8,
+            help="number of pieces per batch of the epoch and inference stages")
+    parser.add_argument("--add-inverse-edges", default=False, action='store_true',
+            help="add the inverse relations")
+    parser.add_argument("--repeat", type=int, default=3,
+            help="number of timed repetitions of every stage")
+    parser.add_argument("--threads", type=int, default=0,
+            help="torch intra-op threads, default: 0 [torch default]")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the pieces in parallel")
+    parser.add_argument("--output", type=str, default="bench_results.json",
+            help="JSON output file")
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -0,0 +1,143 @@
+"""Synthetic score graphs for benchmarking, in the layout of ``read_piece``.
+
+Notes are grouped into chords on a time grid. Notes of a chord are linked by
+``onset`` edges, consecutive chords by ``follows`` edges, and notes starting while
+another note sounds by ``during`` edges, so the degree distributions follow the
+texture of a piano score. Rests are inserted between some consecutive chords.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import os
+import numpy as np
+import pandas as pd
+import torch as th
+
+
+def _pairs(group_start, group_size, src_group, dst_group):
+    """
+    All (src, dst) node pairs between the groups ``src_group[i]`` and ``dst_group[i]`` of every source node ``i``.
+    """
+    counts = group_size[dst_group]
+    src = np.repeat(np.arange(len(src_group)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    dst = np.repeat(group_start[dst_group], counts) + offsets
+    return src, dst
+
+
+def synthetic_piece(num_notes, num_rests=None, add_inverse_edges=False, seed=0, mean_chord=2.0):
+    """
+    A random piece with the relations of ``FILE_LIST``.
+
+    Parameters
+    ----------
+    num_notes : int
+        The number of note nodes.
+    num_rests : int
+        The number of rest nodes, one per 20 chords by default.
+    add_inverse_edges : bool
+        Add a reversed ``<rel>_inv`` relation for every relation.
+    seed : int
+        The random seed.
+    mean_chord : float
+        The mean number of notes per chord.
+
+    Returns
+    -------
+    piece : dict
+        The piece edges and node data as returned by ``read_piece``.
+    """
+    rng = np.random.default_rng(seed)
+    # Chords: sizes >= 1 summing to num_notes.
+    sizes = 1 + rng.poisson(mean_chord - 1, num_notes)
+    n_chords = int(np.searchsorted(np.cumsum(sizes), num_notes)) + 1
+    sizes = sizes[:n_chords]
+    sizes[-1] -= sizes.sum() - num_notes
+    chord_start = np.cumsum(sizes) - sizes
+    chord = np.repeat(np.arange(n_chords), sizes)
+    ioi = rng.choice([0.25, 0.5, 0.5, 1.], n_chords)
+    chord_onset = np.cumsum(ioi) - ioi[0]
+    onset = chord_onset[chord]
+    duration = rng.choice([0.25, 0.5, 1., 2.], num_notes)
+    pitch = rng.integers(30, 90, num_notes).astype(np.float64)
+
+    # onset: every other note of the same chord.
+    src, dst = _pairs(chord_start, sizes, chord, chord)
+    keep = src != dst
+    onset_edges = (src[keep], dst[keep])
+    # follows: every note of the next chord.
+    has_next = chord < n_chords - 1
+    src, dst = _pairs(chord_start, sizes, chord[has_next], chord[has_next] + 1)
+    follows_edges = (np.flatnonzero(has_next)[src], dst)
+    # during: every note of the following chords starting before the note ends.
+    last = np.searchsorted(chord_onset, onset + duration, side='left') - 1
+    first = np.minimum(chord + 1, n_chords - 1)
+    n_during = np.where(last > chord, chord_start[last] + sizes[last] - chord_start[first], 0)
+    src = np.repeat(np.arange(num_notes), n_during)
+    dst = np.repeat(chord_start[first], n_during) + (np.arange(n_during.sum()) - np.repeat(np.cumsum(n_during) - n_during, n_during))
+    during_edges = (src, dst)
+
+    # Rests between a chord and the next one.
+    if num_rests is None:
+        num_rests = max(n_chords // 20, 1)
+    rest_after = np.sort(rng.choice(max(n_chords - 1, 1), num_rests, replace=num_rests > n_chords - 1))
+    rest_onset = chord_onset[rest_after] + ioi[rest_after] / 2
+    src, dst = _pairs(chord_start, sizes, rest_after, rest_after)
+    note_follows_rest = (dst, src)
+    nxt = np.minimum(rest_after + 1, n_chords - 1)
+    src, dst = _pairs(chord_start, sizes, nxt, nxt)
+    rest_follows_note = (src, dst)
+
+    def tensors(edges):
+        return (th.from_numpy(np.ascontiguousarray(edges[0])).long(), th.from_numpy(np.ascontiguousarray(edges[1])).long())
+
+    edge_dict = {
+        ("note", "during", "note"): tensors(during_edges),
+        ("note", "follows", "note"): tensors(follows_edges),
+        ("note", "follows", "rest"): tensors(note_follows_rest),
+        ("note", "onset", "note"): tensors(onset_edges),
+        ("rest", "follows", "note"): tensors(rest_follows_note),
+        }
+    if add_inverse_edges:
+        for (src, rel, dst), (u, v) in list(edge_dict.items()):
+            edge_dict[(dst, rel + "_inv", src)] = (v, u)
+    note_features = np.stack([onset, duration, np.full(num_notes, 4.), pitch], axis=1)
+    rest_features = np.stack([rest_onset, ioi[rest_after] / 2, np.full(num_rests, 4.), np.zeros(num_rests)], axis=1)
+    # Rare positive labels on the notes of the chords before a rest, like cadences at phrase ends.
+    cadence = np.zeros(n_chords, dtype=bool)
+    cadence[rest_after] = True
+    labels = cadence[chord].astype(np.int64)
+    return {
+        "edges": edge_dict,
+        "note": (th.from_numpy(note_features).float(), th.from_numpy(labels)),
+        "rest": (th.from_numpy(rest_features).float(), th.zeros(num_rests, dtype=th.long)),
+        }
+
+
+def synthetic_corpus(num_pieces, num_notes, add_inverse_edges=False, seed=0):
+    """
+    A list of ``num_pieces`` synthetic pieces of ``num_notes`` notes each.
+    """
+    return [synthetic_piece(num_notes, add_inverse_edges=add_inverse_edges, seed=seed + i) for i in range(num_pieces)]
+
+
+def write_csv_piece(piece, location):
+    """
+    Write a synthetic piece in the CSV layout of the dataset.
+    """
+    os.makedirs(location, exist_ok=True)
+    columns = ["onset", "duration", "ts", "pitch"]
+    notes = pd.DataFrame(piece["note"][0].numpy(), columns=columns)
+    notes["label"] = piece["note"][1].numpy()
+    notes.to_csv(os.path.join(location, "note.csv"), index=False)
+    pd.DataFrame(piece["rest"][0].numpy()[:, :3], columns=columns[:3]).to_csv(os.path.join(location, "rest.csv"), index=False)
+    for name, (edges_src, edges_dst) in piece["edges"].items():
+        edges = pd.DataFrame({"src": edges_src.numpy(), "des": edges_dst.numpy()})
+        edges.to_csv(os.path.join(location, "-".join(name) + ".csv"), index=False)
+
+
+def write_csv_corpus(location, names, num_notes, seed=0):
+    """
+    Write a synthetic piece of ``num_notes`` notes in the CSV layout of the dataset for every name of ``names``.
+    """
+    for i, name in enumerate(names):
+        write_csv_piece(synthetic_piece(num_notes, seed=seed + i), os.path.join(location, name))
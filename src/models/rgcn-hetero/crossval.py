@@ -0,0 +1,196 @@
+"""Piece level k-fold cross-validation of the RGCN entity classifier
+
+The pieces are split into k folds, every piece with its augmented copies in the
+same fold, so that no test piece is seen in training under another
+transposition. The per-piece graphs are loaded once from the dataset cache and
+a pool of forked worker processes trains the folds concurrently on that single
+copy. Every fold is tested on its pieces after training on the others, with
+early stopping on the next fold, and the metrics are aggregated over the folds.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import os
+import time
+import pandas as pd
+import torch as th
+import torch.multiprocessing as mp
+from dgl.dataloading import GraphDataLoader
+from torch.utils.data import Subset
+
+from entity_classify import Checkpointer, build_model, load_dataset, run_piece_batches
+
+
+# The dataset and folds shared with the forked workers.
+_SHARED = dict()
+
+
+def fold_split(folds, fold, validation=True):
+    """
+    The train, validation and test graph indices of a fold.
+
+    The fold is the test set and, with ``validation``, the next fold the validation set.
+    Without it, the training graphs are also used for early stopping.
+    """
+    k = len(folds)
+    val_fold = (fold + 1) % k if validation else None
+    train_ids = [i for f in range(k) if f not in (fold, val_fold) for i in folds[f]]
+    val_ids = folds[val_fold] if validation else train_ids
+    return train_ids, val_ids, folds[fold]
+
+
+def run_fold(fold):
+    """
+    Train on the pieces outside the fold, stopping after ``patience`` epochs without a lower validation loss,
+    and test the best epoch on the pieces of the fold.
+
+    Returns
+    -------
+    result : dict
+        The fold, its number of pieces and notes, the best epoch, its validation and test metrics,
+        the number of epochs and the seconds.
+    """
+    args, dataset = _SHARED["args"], _SHARED["dataset"]
+    category = dataset.predict_category
+    train_ids, val_ids, test_ids = fold_split(_SHARED["folds"], fold, args.validation)
+    train_loader = GraphDataLoader(Subset(dataset, train_ids), batch_size=args.piece_batch_size, shuffle=True)
+    val_loader = GraphDataLoader(Subset(dataset, val_ids), batch_size=args.piece_batch_size)
+    test_loader = GraphDataLoader(Subset(dataset, test_ids), batch_size=args.piece_batch_size)
+
+    th.manual_seed(args.seed)
+    g = dataset[0]
+    in_feats = g.nodes[g.ntypes[0]].data['feature'].shape[1]
+    model = build_model(args, in_feats, dataset.num_classes, g)
+    optimizer = th.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.l2norm)
+    checkpointer = Checkpointer(model, optimizer, args.patience)
+
+    t0 = time.time()
+    best_val_acc = None
+    for epoch in range(args.n_epochs):
+        model.train()
+        run_piece_batches(model, train_loader, category, 'cpu', optimizer, dataset.augmentation, args.lazy_aug)
+        model.eval()
+        val_loss, val_acc = run_piece_batches(model, val_loader, category, 'cpu')
+        if val_loss < checkpointer.best_val_loss:
+            best_val_acc = val_acc
+        if checkpointer.update(epoch, val_loss):
+            break
+    checkpointer.restore_best()
+    model.eval()
+    test_loss, test_acc = run_piece_batches(model, test_loader, category, 'cpu')
+    return {
+        "fold": fold, "test_pieces": len({dataset.graph_pieces[i] for i in test_ids}),
+        "test_notes": sum(dataset[i].num_nodes(category) for i in test_ids),
+        "best_epoch": checkpointer.best_epoch, "epochs": epoch + 1, "val_loss": checkpointer.best_val_loss,
+        "val_acc": best_val_acc, "test_loss": test_loss, "test_acc": test_acc, "seconds": time.time() - t0}
+
+
+def aggregate(results):
+    """
+    The mean and standard deviation over the folds of the test metrics, and the pooled accuracy over all test notes.
+    """
+    table = pd.DataFrame(results)
+    notes = table["test_notes"].sum()
+    return {
+        "test_acc_mean": table["test_acc"].mean(), "test_acc_std": table["test_acc"].std(ddof=0),
+        "test_loss_mean": table["test_loss"].mean(), "test_loss_std": table["test_loss"].std(ddof=0),
+        "test_acc_pooled": (table["test_acc"] * table["test_notes"]).sum() / notes,
+    }
+
+
+def _init_worker(num_threads):
+    th.set_num_threads(num_threads)
+
+
+def main(args):
+    """
+    Main Call for piece level k-fold cross-validation of the RGCN on Mozart Data.
+
+    """
+    t0 = time.time()
+    dataset = load_dataset(args, multi_graph=True)
+    folds = dataset.piece_folds(args.folds, seed=args.seed)
+    _SHARED.update(args=args, dataset=dataset, folds=folds)
+    print("Loaded {} pieces in {} graphs in {:.4f}s".format(len(dataset.pieces), len(dataset), time.time() - t0))
+    print("Graphs per fold | " + " | ".join(str(len(fold)) for fold in folds))
+
+    workers = min(args.workers, args.folds)
+    num_threads = args.num_threads if args.num_threads > 0 else max(1, (os.cpu_count() or 1) // workers)
+    print("Running {} folds on {} workers of {} threads...".format(args.folds, workers, num_threads))
+    t0 = time.time()
+    results = []
+    with mp.get_context("fork").Pool(workers, initializer=_init_worker, initargs=(num_threads,)) as pool:
+        for result in pool.imap_unordered(run_fold, range(args.folds)):
+            print("Fold {fold} | Test Acc: {test_acc:.4f} | Test loss: {test_loss:.4f} | "
+                  "Best epoch: {best_epoch} | Epochs: {epochs} | Time: {seconds:.4f}".format(**result))
+            results.append(result)
+    wall = time.time() - t0
+    print("Cross-validated {} folds in {:.4f}s, {:.4f}s of fold training".format(
+        len(results), wall, sum(r["seconds"] for r in results)))
+    print()
+
+    table = pd.DataFrame(results).sort_values("fold")
+    columns = ["fold", "test_pieces", "test_notes", "best_epoch", "epochs", "val_acc", "test_acc", "test_loss", "seconds"]
+    print(table[columns].to_string(index=False))
+    summary = aggregate(results)
+    print("Test Acc: {test_acc_mean:.4f} +- {test_acc_std:.4f} | Pooled Test Acc: {test_acc_pooled:.4f} | "
+          "Test loss: {test_loss_mean:.4f} +- {test_loss_std:.4f}".format(**summary))
+    if args.results is not None:
+        table.to_csv(args.results, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RGCN piece level cross-validation')
+    parser.add_argument("--n-hidden", type=int, default=16,
+            help="number of hidden units")
+    parser.add_argument("--lr", type=float, default=1e-2,
+            help="learning rate")
+    parser.add_argument("--n-layers", type=int, default=2,
+            help="number of propagation rounds")
+    parser.add_argument("-e", "--n-epochs", type=int, default=50,
+            help="maximum number of training epochs per fold")
+    parser.add_argument("--patience", type=int, default=10,
+            help="stop a fold after this many epochs without a lower validation loss, 0 to train all epochs")
+    parser.add_argument("-d", "--dataset", type=str, required=True,
+            help="dataset to use")
+    parser.add_argument("--l2norm", type=float, default=0,
+            help="l2 norm coef")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the dataset augmentation, the folds and the model initialization")
+    parser.add_argument("--force-reload", default=False, action='store_true',
+            help="ignore the cached dataset graphs and rebuild them from the CSVs")
+    parser.add_argument("--raw-dir", type=str, default=None,
+            help="folder of the pieces, default: the DGL download directory")
+    parser.add_argument("--storage", type=str, default="csv", choices=["csv", "npy"],
+            help="csv: piece CSVs, npy: columnar pieces written by utils.to_columnar in --raw-dir")
+    parser.add_argument("--incremental", default=False, action='store_true',
+            help="cache the graph of every --raw-dir piece and rebuild only the changed pieces")
+    parser.add_argument("--lazy-aug", type=int, default=0,
+            help="number of augmented feature variants drawn every epoch instead of materialized graph copies, default: 0 [materialize]")
+    parser.add_argument("--compact", type=str, default=None, choices=["float16", "bfloat16"],
+            help="store the graphs with int32 ids and the node features in this type, default: None [int64 ids, float32 features]")
+    parser.add_argument("--piece-batch-size", type=int, default=8,
+            help="number of piece graphs per batch")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the dataset pieces in parallel")
+    parser.add_argument("--folds", type=int, default=5,
+            help="number of piece folds")
+    parser.add_argument("--workers", type=int, default=5,
+            help="number of folds trained concurrently")
+    parser.add_argument("--num-threads", type=int, default=0,
+            help="torch threads per fold, default: 0 [cores / workers]")
+    parser.add_argument("--results", type=str, default=None,
+            help="write the per fold results to this CSV file")
+    fp = parser.add_mutually_exclusive_group(required=False)
+    fp.add_argument('--validation', dest='validation', action='store_true',
+            help="early stop on the next fold")
+    fp.add_argument('--testing', dest='validation', action='store_false',
+            help="early stop on the training pieces")
+    parser.set_defaults(validation=True, model='rgcn', n_bases=-1)
+
+    args = parser.parse_args()
+    min_folds = 3 if args.validation else 2
+    if args.folds < min_folds:
+        parser.error("--folds must be at least {} to leave training pieces".format(min_folds))
+    print(args)
+    main(args)
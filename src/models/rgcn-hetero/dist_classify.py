@@ -0,0 +1,263 @@
+"""Multi-process CPU data-parallel training of the RGCN entity classifier
+
+Every worker process trains a replica of the model on its shard of the training
+piece graphs. The gradients are averaged with one all-reduce per step over the
+gloo backend, so all replicas take the same optimizer steps. The dataset is
+loaded once and the workers are forked from the loading process, sharing its
+memory.
+
+``--scaling 1,2,4`` trains with every number of workers in turn and reports the
+throughput and the scaling efficiency against one worker.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import json
+import os
+import socket
+import time
+import numpy as np
+import torch as th
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from dgl.dataloading import GraphDataLoader
+from torch.utils.data import Subset
+from torch.utils.data.distributed import DistributedSampler
+
+from entity_classify import build_model, load_dataset, run_piece_batches
+
+
+class AllReduceOptimizer(object):
+    """
+    Wraps an optimizer to average the gradients of all worker processes before every step.
+
+    Parameters
+    ----------
+    optimizer : th.optim.Optimizer
+        The optimizer of the local model replica.
+    params : list
+        The parameters of the local model replica.
+    """
+    def __init__(self, optimizer, params):
+        self.optimizer = optimizer
+        self.params = list(params)
+
+    def zero_grad(self):
+        self.optimizer.zero_grad()
+
+    def step(self):
+        average_gradients(self.params)
+        self.optimizer.step()
+
+
+def average_gradients(params):
+    """
+    Average the gradients of ``params`` over all worker processes, in a single flattened all-reduce.
+
+    Parameters without a gradient in this process (e.g. a relation absent from its batch) count as zero.
+    """
+    grads = [p.grad if p.grad is not None else th.zeros_like(p) for p in params]
+    flat = th.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+    offset = 0
+    for p in params:
+        p.grad = flat[offset:offset + p.numel()].view_as(p)
+        offset += p.numel()
+
+
+def all_reduce(values, op=dist.ReduceOp.SUM):
+    """
+    Reduce a list of floats over all worker processes.
+    """
+    tensor = th.tensor(values, dtype=th.float64)
+    dist.all_reduce(tensor, op=op)
+    return tensor.tolist()
+
+
+def node_average(loss, acc, nodes):
+    """
+    The loss and accuracy averaged over the nodes of all worker processes, from the node averages of every process.
+
+    Returns
+    -------
+    loss, acc : float
+        The node averaged loss and accuracy.
+    nodes : float
+        The total number of nodes.
+    """
+    loss_sum, correct, nodes = all_reduce([loss * nodes, acc * nodes, nodes])
+    return loss_sum / max(nodes, 1), correct / max(nodes, 1), nodes
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_worker(rank, world_size, args, dataset, port, results):
+    """
+    Train one model replica on the ``rank`` shard of the training pieces.
+
+    Rank 0 prints the epochs, saves the model and puts the run summary in ``results``.
+    """
+    num_threads = args.num_threads if args.num_threads > 0 else max(1, (os.cpu_count() or 1) // world_size)
+    th.set_num_threads(num_threads)
+    dist.init_process_group("gloo", init_method="tcp://127.0.0.1:{}".format(port), rank=rank, world_size=world_size)
+
+    category = dataset.predict_category
+    # the same piece split on every worker
+    if args.validation:
+        train_ids, val_ids, test_ids = dataset.piece_split((0.64, 0.16, 0.2), seed=args.seed)
+    else:
+        train_ids, test_ids = dataset.piece_split((0.8, 0.2), seed=args.seed)
+        val_ids = train_ids
+    train_sampler = DistributedSampler(Subset(dataset, train_ids), world_size, rank, shuffle=True, seed=args.seed)
+    train_loader = GraphDataLoader(Subset(dataset, train_ids), batch_size=args.piece_batch_size, sampler=train_sampler)
+    num_nodes = [dataset[i].num_nodes(category) for i in train_ids]
+    # disjoint evaluation shards without the padding of DistributedSampler, so every piece is scored once
+    val_shard, test_shard = val_ids[rank::world_size], test_ids[rank::world_size]
+    val_loader = GraphDataLoader(Subset(dataset, val_shard), batch_size=args.piece_batch_size)
+    test_loader = GraphDataLoader(Subset(dataset, test_shard), batch_size=args.piece_batch_size)
+    val_nodes = sum(dataset[i].num_nodes(category) for i in val_shard)
+    test_nodes = sum(dataset[i].num_nodes(category) for i in test_shard)
+
+    # create the replicas with the weights of rank 0
+    th.manual_seed(args.seed)
+    g = dataset[0]
+    in_feats = g.nodes[g.ntypes[0]].data['feature'].shape[1]
+    model = build_model(args, in_feats, dataset.num_classes, g)
+    for p in model.parameters():
+        dist.broadcast(p.data, src=0)
+    optimizer = AllReduceOptimizer(
+        th.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.l2norm), model.parameters())
+
+    if rank == 0:
+        print("start training with {} workers of {} threads...".format(world_size, num_threads))
+    dur, throughput = [], []
+    for epoch in range(args.n_epochs):
+        train_sampler.set_epoch(epoch)
+        model.train()
+        t0 = time.time()
+        train_loss, train_acc = run_piece_batches(
+            model, train_loader, category, 'cpu', optimizer, dataset.augmentation, args.lazy_aug)
+        seconds = time.time() - t0
+        nodes = sum(num_nodes[i] for i in train_sampler)
+        seconds, = all_reduce([seconds], op=dist.ReduceOp.MAX)
+        train_loss, train_acc, nodes = node_average(train_loss, train_acc, nodes)
+        dur.append(seconds)
+        throughput.append(nodes / seconds)
+        model.eval()
+        val_loss, val_acc = run_piece_batches(model, val_loader, category, 'cpu')
+        val_loss, val_acc, _ = node_average(val_loss, val_acc, val_nodes)
+        if rank == 0:
+            print("Epoch {:05d} | Train Acc: {:.4f} | Train Loss: {:.4f} | Valid Acc: {:.4f} | Valid loss: {:.4f} | Time: {:.4f} | Nodes/s: {:.1f}".
+                  format(epoch, train_acc, train_loss, val_acc, val_loss, np.average(dur), throughput[-1]))
+
+    model.eval()
+    test_loss, test_acc = run_piece_batches(model, test_loader, category, 'cpu')
+    test_loss, test_acc, _ = node_average(test_loss, test_acc, test_nodes)
+    if rank == 0:
+        print("Test Acc: {:.4f} | Test loss: {:.4f}| " .format(test_acc, test_loss))
+        print()
+        if args.model_path is not None:
+            th.save(model.state_dict(), args.model_path)
+        # the first epoch warms up the allocator and the data loaders
+        steady = slice(1, None) if len(dur) > 1 else slice(None)
+        results.put({
+            "workers": world_size,
+            "threads": num_threads,
+            "epoch_seconds": float(np.average(dur[steady])),
+            "nodes_per_second": float(np.average(throughput[steady])),
+            "test_acc": test_acc,
+        })
+    dist.barrier()
+    dist.destroy_process_group()
+
+
+def train(args, dataset, world_size):
+    """
+    Fork ``world_size`` worker processes training on ``dataset`` and return the summary of rank 0.
+    """
+    results = mp.get_context("fork").SimpleQueue()
+    mp.start_processes(run_worker, args=(world_size, args, dataset, free_port(), results),
+                       nprocs=world_size, start_method="fork")
+    return results.get()
+
+
+def main(args):
+    """
+    Main Call for data-parallel Node Classification with RGCN on Mozart Data.
+
+    """
+    dataset = load_dataset(args, multi_graph=True)
+    counts = [int(n) for n in args.scaling.split(',')] if args.scaling else [args.workers]
+
+    summaries = []
+    for world_size in counts:
+        summary = train(args, dataset, world_size)
+        base = summaries[0] if summaries else summary
+        summary["speedup"] = summary["nodes_per_second"] / base["nodes_per_second"]
+        summary["efficiency"] = summary["speedup"] * base["workers"] / world_size
+        summaries.append(summary)
+
+    print("Workers | Threads | Epoch (s) | Nodes/s | Speedup | Efficiency")
+    for s in summaries:
+        print("{:7d} | {:7d} | {:9.4f} | {:7.1f} | {:7.2f} | {:10.2f}".format(
+            s["workers"], s["threads"], s["epoch_seconds"], s["nodes_per_second"], s["speedup"], s["efficiency"]))
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump({"config": vars(args), "results": summaries}, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Data-parallel RGCN')
+    parser.add_argument("--n-hidden", type=int, default=16,
+            help="number of hidden units")
+    parser.add_argument("--lr", type=float, default=1e-2,
+            help="learning rate")
+    parser.add_argument("--n-layers", type=int, default=2,
+            help="number of propagation rounds")
+    parser.add_argument("-e", "--n-epochs", type=int, default=50,
+            help="number of training epochs")
+    parser.add_argument("-d", "--dataset", type=str, required=True,
+            help="dataset to use")
+    parser.add_argument("--model_path", type=str, default=None,
+            help='path for save the model')
+    parser.add_argument("--l2norm", type=float, default=0,
+            help="l2 norm coef")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the dataset augmentation, the piece split and the model initialization")
+    parser.add_argument("--force-reload", default=False, action='store_true',
+            help="ignore the cached dataset graph and rebuild it from the CSVs")
+    parser.add_argument("--raw-dir", type=str, default=None,
+            help="folder of the pieces, default: the DGL download directory")
+    parser.add_argument("--storage", type=str, default="csv", choices=["csv", "npy"],
+            help="csv: piece CSVs, npy: columnar pieces written by utils.to_columnar in --raw-dir")
+    parser.add_argument("--incremental", default=False, action='store_true',
+            help="cache the graph of every --raw-dir piece and rebuild only the changed pieces")
+    parser.add_argument("--lazy-aug", type=int, default=0,
+            help="number of augmented feature variants drawn every epoch instead of materialized graph copies, default: 0 [materialize]")
+    parser.add_argument("--compact", type=str, default=None, choices=["float16", "bfloat16"],
+            help="store the graph with int32 ids and the node features in this type, default: None [int64 ids, float32 features]")
+    parser.add_argument("--piece-batch-size", type=int, default=8,
+            help="number of piece graphs per batch and worker")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the dataset pieces in parallel")
+    parser.add_argument("--workers", type=int, default=2,
+            help="number of training processes")
+    parser.add_argument("--num-threads", type=int, default=0,
+            help="torch threads per training process, default: 0 [cores / workers]")
+    parser.add_argument("--scaling", type=str, default=None,
+            help="comma separated numbers of training processes to run in turn, e.g. 1,2,4, reporting the scaling efficiency")
+    parser.add_argument("--report", type=str, default=None,
+            help="write the throughput and scaling efficiency of every run to this JSON file")
+    fp = parser.add_mutually_exclusive_group(required=False)
+    fp.add_argument('--validation', dest='validation', action='store_true')
+    fp.add_argument('--testing', dest='validation', action='store_false')
+    parser.set_defaults(validation=True, model='rgcn', n_bases=-1)
+
+    args = parser.parse_args()
+    print(args)
+    main(args)
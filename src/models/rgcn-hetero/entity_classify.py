@@ -13,13 +13,17 @@ import torch.nn.functional as F
 import os, sys
 import dgl
 import dgl.nn as dglnn
+from dgl.dataloading import GraphDataLoader
+from torch.utils.data import Subset
 
 
 PACKAGE_PARENT = '..'
 SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
 sys.path.append(os.path.normpath(os.path.join(os.path.join(SCRIPT_DIR, PACKAGE_PARENT), PACKAGE_PARENT)))
 
-from utils import MPGD_cad, MPGD_onset 
+from utils import MPGD_cad, MPGD_onset, Profiler, NULL_PROFILER, torch_trace, partition_graphs, PiecePipeline
+from utils.nc_dataset_class import CAD_URL, ONSET_URL, LazyAugmentation, piece_tasks, piece_parts
+from dgl.data.utils import get_download_dir
 
 # Define a Heterograph Conv model
 class RGCN(nn.Module):
@@ -49,7 +53,6 @@ class RGCN(nn.Module):
     """
     def __init__(self, in_feats, hid_feats, out_feats, rel_names, num_hidden_layers=2):
         super().__init__()
-        self.activation = True
         self.layers = nn.ModuleList()
         self.num_hidden_layers = num_hidden_layers
             
@@ -74,22 +77,116 @@ class RGCN(nn.Module):
 
         Parameters
         ----------
-        graph : dgl object
-            A heterogenous graph
+        graph : dgl object or list
+            A heterogenous graph, or a list of message flow graph blocks with one block per layer.
         inputs : dict
             A dictionary with the predict category node type features.
+            For blocks, the features of the source nodes of the first block.
         """
-        # inputs are features of nodes
-        h = {k : F.normalize(v) for k, v in inputs.items()}  
-        for i, conv_l in enumerate(self.layers):
-            h = conv_l(graph, h)
-            if i == len(self.layers)-1:
-                self.activation = False
-            if self.activation:
+        blocks = graph if isinstance(graph, list) else [graph] * len(self.layers)
+        # inputs are features of nodes, upcast from compact float16 / bfloat16 storage
+        h = {k : F.normalize(v.float()) for k, v in inputs.items()}  
+        for i, (conv_l, block) in enumerate(zip(self.layers, blocks)):
+            h = conv_l(block, h)
+            if i != len(self.layers)-1:
                 h = {k: F.relu(v) for k, v in h.items()}
         return h
 
 
+class BasisRGCN(nn.Module):
+    """
+    A Relational Graph Convolutional Network with basis decomposed weights.
+
+    The relation weights of every layer are linear combinations of ``num_bases`` shared bases,
+    and the message passing of all relations runs as one typed operation (``dglnn.RelGraphConv``)
+    on the homogeneous version of the heterogenous graph.
+
+    Parameters
+    ----------
+    in_feats : int
+        The size of the Node Feature Vector
+    hid_feats : int
+        The size of the Latent Node Feature Representation of the hidden layers
+    out_feats : int
+        The number of the node classes we want to predict.
+    rel_names : list
+        The graph canonical edge types
+    num_bases : int
+        The number of bases, all relations if -1.
+    num_hidden_layers : int
+        The number of Hidden layers.
+    self_loop : bool
+        Include the self feature of the nodes.
+    dropout : float
+        Dropout probability.
+
+    Attributes
+    ----------
+    layers : nn.ModuleList()
+        The number of layers and information about inputs and outputs
+    num_hidden_layers : int
+        The number of hidden layers
+
+    """
+    def __init__(self, in_feats, hid_feats, out_feats, rel_names, num_bases=-1, num_hidden_layers=2, self_loop=False, dropout=0):
+        super().__init__()
+        self.layers = nn.ModuleList()
+        self.num_hidden_layers = num_hidden_layers
+        num_rels = len(rel_names)
+        num_bases = None if num_bases <= 0 or num_bases > num_rels else num_bases
+        dims = [in_feats] + [hid_feats] * (num_hidden_layers + 1) + [out_feats]
+        for i in range(len(dims) - 1):
+            self.layers.append(dglnn.RelGraphConv(
+                dims[i], dims[i+1], num_rels, regularizer='basis', num_bases=num_bases,
+                activation=F.relu if i < len(dims) - 2 else None, self_loop=self_loop, dropout=dropout))
+        self._homogeneous = None
+
+    def homogeneous(self, graph):
+        """
+        The homogeneous graph, edge types and edge normalization of a heterogenous graph, cached for the last graph.
+        """
+        if self._homogeneous is None or self._homogeneous[0] is not graph:
+            hg = dgl.to_homogeneous(graph)
+            # 1 / in-degree of the destination node in the relation of every edge, in homogeneous edge order.
+            norm = []
+            for etype in graph.canonical_etypes:
+                _, dst = graph.edges(etype=etype)
+                norm.append(1. / graph.in_degrees(dst, etype=etype).float().clamp(min=1))
+            self._homogeneous = (graph, hg, hg.edata[dgl.ETYPE], th.cat(norm).unsqueeze(1))
+        return self._homogeneous[1:]
+
+    def forward(self, graph, inputs):
+        """
+        Forward Funtion
+
+        Parameters
+        ----------
+        graph : dgl object
+            A heterogenous graph
+        inputs : dict
+            A dictionary with the features of every node type.
+        """
+        if isinstance(graph, list):
+            raise ValueError("BasisRGCN does not support message flow graph blocks")
+        hg, etypes, norm = self.homogeneous(graph)
+        # Homogeneous node order: node types in graph.ntypes order.
+        h = th.cat([F.normalize(inputs[nt].float()) for nt in graph.ntypes])
+        for conv_l in self.layers:
+            h = conv_l(hg, h, etypes, norm)
+        return dict(zip(graph.ntypes, th.split(h, [graph.num_nodes(nt) for nt in graph.ntypes])))
+
+
+def build_model(args, in_feats, num_classes, g):
+    """
+    The model selected by the command line arguments.
+    """
+    if args.model == 'basis':
+        return BasisRGCN(in_feats, args.n_hidden, num_classes, g.canonical_etypes, num_bases=args.n_bases,
+            num_hidden_layers=args.n_layers - 2, self_loop=args.use_self_loop, dropout=args.dropout)
+    return RGCN(in_feats, args.n_hidden, num_classes, g.etypes,
+        num_hidden_layers=args.n_layers - 2)
+
+
 def standarization(x):
     """
     Typical matrix standarization
@@ -164,21 +261,503 @@ def softmax_focal_loss(x, target, gamma=2, alpha=0.5):
 
 
 
-def main(args):
+def load_dataset(args, multi_graph=False, profiler=NULL_PROFILER):
     """
-    Main Call for Node Classification with RGCN on Mozart Data.
-
+    Load the dataset selected by the command line arguments.
     """
-
     # load graph data (from submodule repo)
     if args.dataset == 'mps_cad':
         print("Loading Mozart Sonatas For Cadence Detection")
-        dataset = MPGD_cad() # select_piece = "K533-1"
+        dataset = MPGD_cad(raw_dir=args.raw_dir, storage=args.storage, lazy_aug=args.lazy_aug > 0, multi_graph=multi_graph, seed=args.seed, num_workers=args.num_workers, profiler=profiler, compact=args.compact, incremental=args.incremental, force_reload=args.force_reload) # select_piece = "K533-1"
     elif args.dataset == "mps_onset":
         print("Loading Mozart Sonatas For Bar Onset Detection")
-        dataset = MPGD_onset()
+        dataset = MPGD_onset(raw_dir=args.raw_dir, storage=args.storage, lazy_aug=args.lazy_aug > 0, multi_graph=multi_graph, seed=args.seed, num_workers=args.num_workers, profiler=profiler, compact=args.compact, incremental=args.incremental, force_reload=args.force_reload)
     else:
         raise ValueError()
+    return dataset
+
+
+def make_profiler(args):
+    """
+    The profiler selected by ``--profile`` and ``--profile-trace``, a no-op one if neither is given.
+    """
+    if args.profile is None and args.profile_trace is None:
+        return NULL_PROFILER
+    return Profiler(args.profile, cuda_sync=args.gpu >= 0, record_functions=args.profile_trace is not None)
+
+
+class Checkpointer(object):
+    """
+    Early stopping on the validation loss, keeping the weights of the best epoch.
+
+    Parameters
+    ----------
+    model : nn.Module
+        The trained model.
+    optimizer : th.optim.Optimizer
+        The optimizer of the model.
+    patience : int
+        Stop after this many epochs without a lower validation loss, 0 to never stop early.
+    path : str
+        Save the model, the optimizer and the best weights to this file after every evaluation, to resume the run.
+
+    Attributes
+    ----------
+    start_epoch : int
+        The first epoch to train, after the last epoch of a resumed checkpoint.
+    best_epoch : int
+        The epoch of the lowest validation loss, -1 before the first evaluation.
+    best_val_loss : float
+        The lowest validation loss.
+    """
+    def __init__(self, model, optimizer, patience=0, path=None):
+        self.model = model
+        self.optimizer = optimizer
+        self.patience = patience
+        self.path = path
+        self.start_epoch = 0
+        self.best_epoch = -1
+        self.best_val_loss = float('inf')
+        self.best_state = None
+
+    def resume(self, path):
+        """
+        Continue the run saved in the checkpoint file ``path``.
+        """
+        checkpoint = th.load(path, map_location='cpu')
+        self.model.load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.start_epoch = checkpoint['epoch'] + 1
+        self.best_epoch = checkpoint['best_epoch']
+        self.best_val_loss = checkpoint['best_val_loss']
+        self.best_state = checkpoint['best_model']
+        print("Resumed from {} at epoch {:05d} | Best Valid loss: {:.4f} at epoch {:05d}".format(
+            path, self.start_epoch, self.best_val_loss, self.best_epoch))
+
+    def update(self, epoch, val_loss):
+        """
+        Record the validation loss of ``epoch`` and save the checkpoint.
+
+        Returns
+        -------
+        stop : bool
+            Whether the validation loss did not improve for ``patience`` epochs.
+        """
+        if val_loss < self.best_val_loss:
+            self.best_val_loss = val_loss
+            self.best_epoch = epoch
+            self.best_state = {k: v.detach().cpu().clone() for k, v in self.model.state_dict().items()}
+        if self.path is not None:
+            self.save(epoch)
+        return self.patience > 0 and epoch - self.best_epoch >= self.patience
+
+    def save(self, epoch):
+        checkpoint = {
+            'epoch': epoch,
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'best_model': self.best_state,
+            'best_epoch': self.best_epoch,
+            'best_val_loss': self.best_val_loss,
+        }
+        # write then rename, so that an interrupted save keeps the previous checkpoint
+        th.save(checkpoint, self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+
+    def restore_best(self):
+        """
+        Load the weights of the best epoch into the model.
+        """
+        if self.best_state is not None:
+            self.model.load_state_dict(self.best_state)
+            print("Restored the weights of epoch {:05d} | Valid loss: {:.4f}".format(self.best_epoch, self.best_val_loss))
+
+
+def make_checkpointer(args, model, optimizer):
+    """
+    The checkpointer selected by ``--patience``, ``--checkpoint`` and ``--resume``.
+    """
+    checkpointer = Checkpointer(model, optimizer, args.patience, args.checkpoint)
+    if args.resume is not None:
+        checkpointer.resume(args.resume)
+    return checkpointer
+
+
+def is_eval_epoch(args, epoch):
+    """
+    Whether to evaluate after ``epoch``: every ``--eval-every`` epochs and after the last one.
+    """
+    return (epoch + 1) % args.eval_every == 0 or epoch + 1 == args.n_epochs
+
+
+def print_epoch(epoch, train_acc, train_loss, val_acc, val_loss, seconds, suffix=""):
+    """
+    Print the metrics of an epoch, without the validation ones if it was not evaluated.
+    """
+    line = "Epoch {:05d} | Train Acc: {:.4f} | Train Loss: {:.4f}".format(epoch, train_acc, train_loss)
+    if val_loss is not None:
+        line += " | Valid Acc: {:.4f} | Valid loss: {:.4f}".format(val_acc, val_loss)
+    print(line + " | Time: {:.4f}".format(seconds) + suffix)
+
+
+def train_and_test(args, model, checkpointer, train_epoch, evaluate, val_data, test_data, profiler=NULL_PROFILER, timed_from=0, data_wait=None):
+    """
+    The training loop shared by the training modes, followed by the test of the final (or best) weights.
+
+    Every ``--eval-every`` epochs the model is evaluated on the validation data, for early stopping
+    and checkpoints. The best weights are restored with ``--patience`` and saved to ``--model_path``.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+    model : nn.Module
+        The trained model.
+    checkpointer : Checkpointer
+        The early stopping and checkpoints of the run.
+    train_epoch : callable
+        Train the model for an epoch and return its train loss and accuracy.
+    evaluate : callable
+        The loss and accuracy of the model on ``val_data`` or ``test_data``.
+    val_data, test_data
+        The validation and test data passed to ``evaluate``, e.g. data loaders or node indices.
+    profiler : Profiler
+        Flushed after every epoch.
+    timed_from : int
+        The first epoch counted in the average epoch time, to skip the warm-up epochs.
+    data_wait : callable
+        The seconds spent waiting for the data in the last epoch, printed and flushed if given.
+    """
+    print("start training...")
+    dur = []
+    with torch_trace(args.profile_trace):
+        for epoch in range(checkpointer.start_epoch, args.n_epochs):
+            model.train()
+            t0 = time.time()
+            train_loss, train_acc = train_epoch()
+            seconds = time.time() - t0
+            if epoch >= timed_from:
+                dur.append(seconds)
+            val_loss = val_acc = None
+            if is_eval_epoch(args, epoch):
+                model.eval()
+                with profiler.section("evaluate"):
+                    val_loss, val_acc = evaluate(val_data)
+            fields, suffix = dict(), ""
+            if data_wait is not None:
+                fields["data_wait_seconds"] = data_wait()
+                suffix = " | Data wait: {:.4f}".format(fields["data_wait_seconds"])
+            print_epoch(epoch, train_acc, train_loss, val_acc, val_loss, np.average(dur), suffix)
+            profiler.flush(phase="train", epoch=epoch, epoch_seconds=seconds, train_loss=train_loss, train_acc=train_acc,
+                           val_loss=val_loss, val_acc=val_acc, **fields)
+            if val_loss is not None and checkpointer.update(epoch, val_loss):
+                print("Early stopping: no lower Valid loss for {} epochs".format(epoch - checkpointer.best_epoch))
+                break
+    profiler.close()
+    print()
+    if args.patience > 0:
+        checkpointer.restore_best()
+    if args.model_path is not None:
+        th.save(model.state_dict(), args.model_path)
+
+    model.eval()
+    test_loss, test_acc = evaluate(test_data)
+    print("Test Acc: {:.4f} | Test loss: {:.4f}| " .format(test_acc, test_loss))
+    print()
+
+
+def run_piece_batches(model, dataloader, category, device, optimizer=None, augmentation=None, num_variants=0, profiler=NULL_PROFILER):
+    """
+    One pass over batches of piece graphs.
+
+    Parameters
+    ----------
+    model : RGCN
+        The model.
+    dataloader : GraphDataLoader
+        The batches of piece graphs, or of onset windows whose 'core' nodes only are scored.
+    category : str
+        The node type to classify.
+    device : str
+        The device of the forward passes.
+    optimizer : th.optim.Optimizer
+        Take a step per batch. No gradients are computed if None.
+    augmentation : LazyAugmentation
+        Also train on ``num_variants`` augmented note features per batch.
+    num_variants : int
+        The number of augmented variants.
+    profiler : Profiler
+        Times the data loading, forward, loss, backward and step of every batch.
+
+    Returns
+    -------
+    loss, acc : float
+        The node averaged loss and accuracy.
+    """
+    total_loss, total_correct, total_nodes = 0., 0, 0
+    with th.set_grad_enabled(optimizer is not None):
+        for bg in profiler.iterate(dataloader, "data"):
+            with profiler.section("to_device"):
+                bg = bg.to(device)
+            node_features = {nt: bg.nodes[nt].data['feature'] for nt in bg.ntypes}
+            labels = bg.nodes[category].data['labels']
+            # Onset windows: the halo nodes are context only.
+            core = bg.nodes[category].data['core'] if 'core' in bg.nodes[category].data else slice(None)
+            labels = labels[core]
+            with profiler.section("forward"):
+                logits = model(bg, node_features)[category][core]
+            with profiler.section("loss"):
+                loss = F.cross_entropy(logits, labels)
+            if optimizer is not None:
+                if augmentation is not None:
+                    with profiler.section("augment"):
+                        piece = bg.nodes[category].data['piece']
+                        for features in augmentation(node_features[category], piece, num_variants):
+                            aug_logits = model(bg, dict(node_features, **{category: features}))[category][core]
+                            loss = loss + F.cross_entropy(aug_logits, labels)
+                        loss = loss / (num_variants + 1)
+                optimizer.zero_grad()
+                with profiler.section("backward"):
+                    loss.backward()
+                with profiler.section("step"):
+                    optimizer.step()
+            total_loss += loss.item() * labels.shape[0]
+            total_correct += th.sum(logits.argmax(dim=1) == labels).item()
+            total_nodes += labels.shape[0]
+    return total_loss / max(total_nodes, 1), total_correct / max(total_nodes, 1)
+
+
+def main_piece_batches(args, dataset, profiler=NULL_PROFILER):
+    """
+    Node Classification with RGCN trained on batches of piece graphs, with a piece level split.
+
+    """
+    category = dataset.predict_category
+    # split pieces into train, validate, test
+    if args.validation:
+        train_ids, val_ids, test_ids = dataset.piece_split((0.64, 0.16, 0.2), seed=args.seed)
+    else:
+        train_ids, test_ids = dataset.piece_split((0.8, 0.2), seed=args.seed)
+        val_ids = train_ids
+    print("Pieces per split | Train: {} | Valid: {} | Test: {}".format(len(train_ids), len(val_ids), len(test_ids)))
+    if args.window > 0:
+        # Batches of onset windows instead of whole pieces, every note scored once in its core window.
+        train_set, val_set, test_set = [
+            partition_graphs([dataset[i] for i in ids], args.window, args.halo, category)[0]
+            for ids in (train_ids, val_ids, test_ids)]
+        print("Windows per split | Train: {} | Valid: {} | Test: {}".format(len(train_set), len(val_set), len(test_set)))
+    else:
+        train_set, val_set, test_set = Subset(dataset, train_ids), Subset(dataset, val_ids), Subset(dataset, test_ids)
+    train_loader = GraphDataLoader(train_set, batch_size=args.piece_batch_size, shuffle=True)
+    val_loader = GraphDataLoader(val_set, batch_size=args.piece_batch_size)
+    test_loader = GraphDataLoader(test_set, batch_size=args.piece_batch_size)
+
+    # check cuda
+    use_cuda = args.gpu >= 0 and th.cuda.is_available()
+    device = 'cuda:%d' % args.gpu if use_cuda else 'cpu'
+    if use_cuda:
+        th.cuda.set_device(args.gpu)
+
+    # create model
+    g = dataset[0]
+    in_feats = g.nodes[g.ntypes[0]].data['feature'].shape[1]
+    model = build_model(args, in_feats, dataset.num_classes, g).to(device)
+    optimizer = th.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.l2norm)
+    profiler.attach(model)
+    checkpointer = make_checkpointer(args, model, optimizer)
+
+    # training loop
+    def train_epoch():
+        return run_piece_batches(model, train_loader, category, device, optimizer, dataset.augmentation, args.lazy_aug, profiler)
+    def evaluate(loader):
+        return run_piece_batches(model, loader, category, device)
+    train_and_test(args, model, checkpointer, train_epoch, evaluate, val_loader, test_loader, profiler)
+
+
+def main_stream(args, profiler=NULL_PROFILER):
+    """
+    Node Classification with RGCN trained on batches of piece graphs built in the background while training,
+    with a piece level split. No piece graph is cached or held in memory beyond the prefetched batches.
+
+    """
+    if args.num_classes <= 0:
+        raise ValueError("--stream needs --num-classes")
+    if args.dataset == 'mps_cad':
+        url = CAD_URL
+    elif args.dataset == "mps_onset":
+        url = ONSET_URL
+    else:
+        raise ValueError()
+    # the piece augmentations of MozartPianoGraphDataset
+    aug_seed = None if args.lazy_aug > 0 else (lambda fn: "{}-{}".format(args.seed, fn))
+    raw_dir = args.raw_dir if args.raw_dir is not None else get_download_dir()
+    tasks = piece_tasks(url, raw_dir, storage=args.storage, aug_seed=aug_seed)
+    category = "note"
+    fractions = (0.64, 0.16, 0.2) if args.validation else (0.8, 0.2)
+    part_of_piece = piece_parts(len(tasks), fractions, seed=args.seed)
+    splits = [[task for p, task in enumerate(tasks) if part_of_piece[p] == k] for k in range(len(fractions))]
+    train_tasks, val_tasks, test_tasks = splits if args.validation else (splits[0], splits[0], splits[1])
+    print("Pieces per split | Train: {} | Valid: {} | Test: {}".format(len(train_tasks), len(val_tasks), len(test_tasks)))
+    def pipeline(split_tasks, shuffle):
+        return PiecePipeline(split_tasks, batch_size=args.piece_batch_size, num_workers=args.num_workers,
+                             prefetch=args.prefetch, compact=args.compact, shuffle=shuffle, seed=args.seed)
+    train_stream, val_stream, test_stream = pipeline(train_tasks, True), pipeline(val_tasks, False), pipeline(test_tasks, False)
+    augmentation = LazyAugmentation(seed=args.seed) if args.lazy_aug > 0 else None
+
+    # check cuda
+    use_cuda = args.gpu >= 0 and th.cuda.is_available()
+    device = 'cuda:%d' % args.gpu if use_cuda else 'cpu'
+    if use_cuda:
+        th.cuda.set_device(args.gpu)
+
+    # create model
+    _, location, file_list, note_columns, _ = train_tasks[0]
+    if args.storage == "npy":
+        # the columnar arrays '<ntype>.feature.npy' and '<src>-<rel>-<dst>.src.npy'
+        in_feats = np.load(os.path.join(location, "note.feature.npy"), mmap_mode="r").shape[1]
+        file_list = [fn for fn in os.listdir(location) if fn.endswith(".src.npy")]
+    else:
+        in_feats = len(note_columns)
+    # the relations of the piece files '<src>-<rel>-<dst>.csv'
+    rel_names = sorted({fn.split(".")[0].split("-")[1] for fn in file_list if fn.split(".")[0].count("-") == 2})
+    model = RGCN(in_feats, args.n_hidden, args.num_classes, rel_names, num_hidden_layers=args.n_layers - 2).to(device)
+    optimizer = th.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.l2norm)
+    profiler.attach(model)
+    checkpointer = make_checkpointer(args, model, optimizer)
+
+    # training loop
+    def train_epoch():
+        return run_piece_batches(model, train_stream, category, device, optimizer, augmentation, args.lazy_aug, profiler)
+    def evaluate(stream):
+        return run_piece_batches(model, stream, category, device)
+    try:
+        train_and_test(args, model, checkpointer, train_epoch, evaluate, val_stream, test_stream, profiler,
+                       data_wait=lambda: train_stream.wait_seconds)
+    finally:
+        for stream in (train_stream, val_stream, test_stream):
+            stream.close()
+
+
+def run_node_batches(model, dataloader, node_features, labels, category, device, optimizer=None, augmentation=None, num_variants=0, piece=None, profiler=NULL_PROFILER):
+    """
+    One pass over neighbor sampled mini-batches of nodes.
+
+    Parameters
+    ----------
+    model : RGCN
+        The model.
+    dataloader : NodeDataLoader
+        The seed nodes with their message flow graph blocks.
+    node_features : dict
+        The features of every node type of the full graph.
+    labels : tensor
+        The labels of the predict category nodes of the full graph.
+    category : str
+        The node type to classify.
+    device : str
+        The device of the forward passes.
+    optimizer : th.optim.Optimizer
+        Take a step per batch. No gradients are computed if None.
+    augmentation : LazyAugmentation
+        Also train on ``num_variants`` augmented note features per batch.
+    num_variants : int
+        The number of augmented variants.
+    piece : tensor
+        The piece index of the predict category nodes, for the augmentation.
+    profiler : Profiler
+        Times the sampling, forward, loss, backward and step of every batch.
+
+    Returns
+    -------
+    loss, acc : float
+        The node averaged loss and accuracy.
+    """
+    total_loss, total_correct, total_nodes = 0., 0, 0
+    with th.set_grad_enabled(optimizer is not None):
+        for input_nodes, output_nodes, blocks in profiler.iterate(dataloader, "data"):
+            with profiler.section("to_device"):
+                blocks = [block.to(device) for block in blocks]
+                inputs = {nt: node_features[nt][input_nodes[nt].long()].to(device) for nt in input_nodes}
+                batch_labels = labels[output_nodes[category].long()].to(device)
+            with profiler.section("forward"):
+                logits = model(blocks, inputs)[category]
+            with profiler.section("loss"):
+                loss = F.cross_entropy(logits, batch_labels)
+            if optimizer is not None:
+                if augmentation is not None:
+                    with profiler.section("augment"):
+                        batch_piece = piece[input_nodes[category].long()].to(device)
+                        for features in augmentation(inputs[category], batch_piece, num_variants):
+                            aug_logits = model(blocks, dict(inputs, **{category: features}))[category]
+                            loss = loss + F.cross_entropy(aug_logits, batch_labels)
+                        loss = loss / (num_variants + 1)
+                optimizer.zero_grad()
+                with profiler.section("backward"):
+                    loss.backward()
+                with profiler.section("step"):
+                    optimizer.step()
+            total_loss += loss.item() * batch_labels.shape[0]
+            total_correct += th.sum(logits.argmax(dim=1) == batch_labels).item()
+            total_nodes += batch_labels.shape[0]
+    return total_loss / max(total_nodes, 1), total_correct / max(total_nodes, 1)
+
+
+def main_sampled(args, g, category, num_classes, labels, train_idx, val_idx, test_idx, augmentation=None, profiler=NULL_PROFILER):
+    """
+    Node Classification with RGCN trained on neighbor sampled mini-batches of the predict category nodes.
+
+    """
+    use_cuda = args.gpu >= 0 and th.cuda.is_available()
+    device = 'cuda:%d' % args.gpu if use_cuda else 'cpu'
+    if use_cuda:
+        th.cuda.set_device(args.gpu)
+
+    fanouts = [int(f) for f in args.fanout.split(',')]
+    if len(fanouts) == 1:
+        fanouts = fanouts * args.n_layers
+    if len(fanouts) != args.n_layers:
+        raise ValueError("--fanout needs one value or one value per layer ({} layers)".format(args.n_layers))
+    sampler = dgl.dataloading.MultiLayerNeighborSampler(fanouts)
+    def node_loader(idx, shuffle):
+        return dgl.dataloading.NodeDataLoader(
+            g, {category: idx.to(g.idtype)}, sampler, batch_size=args.batch_size, shuffle=shuffle, drop_last=False,
+            num_workers=args.sampler_workers)
+    train_loader = node_loader(train_idx, True)
+    val_loader = node_loader(val_idx, False)
+    test_loader = node_loader(test_idx, False)
+
+    # create model
+    in_feats = g.nodes[g.ntypes[0]].data['feature'].shape[1]
+    model = build_model(args, in_feats, num_classes, g).to(device)
+    node_features = {nt: g.nodes[nt].data['feature'] for nt in g.ntypes}
+    piece = g.nodes[category].data['piece'] if augmentation is not None else None
+    optimizer = th.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.l2norm)
+    profiler.attach(model)
+    checkpointer = make_checkpointer(args, model, optimizer)
+
+    # training loop
+    def train_epoch():
+        return run_node_batches(
+            model, train_loader, node_features, labels, category, device, optimizer, augmentation, args.lazy_aug, piece, profiler)
+    def evaluate(loader):
+        return run_node_batches(model, loader, node_features, labels, category, device)
+    train_and_test(args, model, checkpointer, train_epoch, evaluate, val_loader, test_loader, profiler)
+
+
+def main(args):
+    """
+    Main Call for Node Classification with RGCN on Mozart Data.
+
+    """
+    profiler = make_profiler(args)
+    if args.stream:
+        return main_stream(args, profiler)
+    dataset = load_dataset(args, multi_graph=args.multi_graph, profiler=profiler)
+    profiler.flush(phase="dataset")
+    if args.multi_graph:
+        return main_piece_batches(args, dataset, profiler)
+    if args.window > 0:
+        raise ValueError("--window needs --multi-graph")
 
     # Load the Hetero graph
     g = dataset[0]
@@ -205,6 +784,11 @@ def main(args):
     else:
         val_idx = train_idx
 
+    if args.batch_size > 0:
+        if args.model == 'basis':
+            raise ValueError("--batch-size needs --model rgcn")
+        return main_sampled(args, g, category, num_classes, labels, train_idx, val_idx, test_idx, dataset.augmentation, profiler)
+
     # check cuda
     use_cuda = args.gpu >= 0 and th.cuda.is_available()
     if use_cuda:
@@ -216,52 +800,52 @@ def main(args):
 
     # create model
     in_feats = g.nodes[g.ntypes[0]].data['feature'].shape[1]
-    model = RGCN(in_feats, args.n_hidden, num_classes, g.etypes, 
-        num_hidden_layers=args.n_layers - 2)
+    model = build_model(args, in_feats, num_classes, g)
     # Load the node features as a Dictionary to feed to the forward layer.
     node_features = {nt: g.nodes[nt].data['feature'] for nt in g.ntypes}
+    # Augmentations drawn on the fly on a single copy of the graph.
+    augmentation = dataset.augmentation
+    if augmentation is not None:
+        piece = g.nodes[category].data['piece']
 
     if use_cuda:
         model.cuda()
 
     # optimizer
     optimizer = th.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.l2norm)
+    profiler.attach(model)
+    checkpointer = make_checkpointer(args, model, optimizer)
 
     # training loop
-    print("start training...")
-    dur = []
-    model.train()
-    for epoch in range(args.n_epochs):
+    def train_epoch():
         optimizer.zero_grad()
-        if epoch > 5:
-            t0 = time.time()
-        logits = model(g, node_features)[category]
-        # loss = softmax_focal_loss(logits[train_idx], labels[train_idx]) 
-        loss = F.cross_entropy(logits[train_idx], labels[train_idx]) 
-        loss.backward()
-        optimizer.step()
-        t1 = time.time()
-
-        if epoch > 5:
-            dur.append(t1 - t0)
+        with profiler.section("forward"):
+            logits = model(g, node_features)[category]
+        with profiler.section("loss"):
+            # loss = softmax_focal_loss(logits[train_idx], labels[train_idx]) 
+            loss = F.cross_entropy(logits[train_idx], labels[train_idx]) 
+        if augmentation is not None:
+            with profiler.section("augment"):
+                for features in augmentation(node_features[category], piece, args.lazy_aug):
+                    aug_logits = model(g, dict(node_features, **{category: features}))[category]
+                    loss = loss + F.cross_entropy(aug_logits[train_idx], labels[train_idx])
+                loss = loss / (args.lazy_aug + 1)
+        with profiler.section("backward"):
+            loss.backward()
+        with profiler.section("step"):
+            optimizer.step()
         train_acc = th.sum(logits[train_idx].argmax(dim=1) == labels[train_idx]).item() / len(train_idx)
-        # val_loss = softmax_focal_loss(logits[val_idx], labels[val_idx])
-        val_loss = F.cross_entropy(logits[val_idx], labels[val_idx])
-        val_acc = th.sum(logits[val_idx].argmax(dim=1) == labels[val_idx]).item() / len(val_idx)
-        print("Epoch {:05d} | Train Acc: {:.4f} | Train Loss: {:.4f} | Valid Acc: {:.4f} | Valid loss: {:.4f} | Time: {:.4f}".
-              format(epoch, train_acc, loss.item(), val_acc, val_loss.item(), np.average(dur)))
-    print()
-    if args.model_path is not None:
-        th.save(model.state_dict(), args.model_path)
-
-    model.eval()
-    logits = model.forward(g, node_features)[category]
-    # test_loss = softmax_focal_loss(logits[test_idx], labels[test_idx])
-    test_loss = F.cross_entropy(logits[test_idx], labels[test_idx])
-    test_acc = th.sum(logits[test_idx].argmax(dim=1) == labels[test_idx]).item() / len(test_idx)
-
-    print("Test Acc: {:.4f} | Test loss: {:.4f}| " .format(test_acc, test_loss.item()))
-    print()
+        return loss.item(), train_acc
+    def evaluate(idx):
+        # a separate forward without dropout nor autograd
+        with th.no_grad():
+            logits = model(g, node_features)[category]
+        # loss = softmax_focal_loss(logits[idx], labels[idx])
+        loss = F.cross_entropy(logits[idx], labels[idx]).item()
+        acc = th.sum(logits[idx].argmax(dim=1) == labels[idx]).item() / len(idx)
+        return loss, acc
+    # the first epochs are warm-up, left out of the average epoch time
+    train_and_test(args, model, checkpointer, train_epoch, evaluate, val_idx, test_idx, profiler, timed_from=6)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='RGCN')
@@ -273,6 +857,8 @@ if __name__ == '__main__':
             help="gpu")
     parser.add_argument("--lr", type=float, default=1e-2,
             help="learning rate")
+    parser.add_argument("--model", type=str, default="rgcn", choices=["rgcn", "basis"],
+            help="rgcn: one GraphConv per relation, basis: basis decomposed RelGraphConv over all relations")
     parser.add_argument("--n-bases", type=int, default=-1,
             help="number of filter weight matrices, default: -1 [use all]")
     parser.add_argument("--n-layers", type=int, default=2,
@@ -283,15 +869,65 @@ if __name__ == '__main__':
             help="dataset to use")
     parser.add_argument("--model_path", type=str, default=None,
             help='path for save the model')
+    parser.add_argument("--eval-every", type=int, default=1,
+            help="evaluate on the validation set every this many epochs and after the last one")
+    parser.add_argument("--patience", type=int, default=0,
+            help="stop after this many epochs without a lower validation loss and keep the best weights, default: 0 [train all epochs]")
+    parser.add_argument("--checkpoint", type=str, default=None,
+            help="save the model, the optimizer and the best weights to this file after every evaluation")
+    parser.add_argument("--resume", type=str, default=None,
+            help="resume training from this checkpoint file")
     parser.add_argument("--l2norm", type=float, default=0,
             help="l2 norm coef")
     parser.add_argument("--use-self-loop", default=False, action='store_true',
             help="include self feature as a special relation")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the dataset augmentation")
+    parser.add_argument("--force-reload", default=False, action='store_true',
+            help="ignore the cached dataset graph and rebuild it from the CSVs")
+    parser.add_argument("--raw-dir", type=str, default=None,
+            help="folder of the pieces, default: the DGL download directory")
+    parser.add_argument("--storage", type=str, default="csv", choices=["csv", "npy"],
+            help="csv: piece CSVs, npy: columnar pieces written by utils.to_columnar in --raw-dir")
+    parser.add_argument("--incremental", default=False, action='store_true',
+            help="cache the graph of every --raw-dir piece and rebuild only the changed pieces")
+    parser.add_argument("--lazy-aug", type=int, default=0,
+            help="number of augmented feature variants drawn every epoch instead of materialized graph copies, default: 0 [materialize]")
+    parser.add_argument("--compact", type=str, default=None, choices=["float16", "bfloat16"],
+            help="store the graph with int32 ids and the node features in this type, default: None [int64 ids, float32 features]")
+    parser.add_argument("--multi-graph", default=False, action='store_true',
+            help="train on batches of piece graphs with a piece level train/validation/test split")
+    parser.add_argument("--piece-batch-size", type=int, default=8,
+            help="number of piece graphs per batch with --multi-graph")
+    parser.add_argument("--stream", default=False, action='store_true',
+            help="train on batches of piece graphs built in the background from the piece CSVs, without building the dataset")
+    parser.add_argument("--prefetch", type=int, default=4,
+            help="number of batches built ahead of training with --stream")
+    parser.add_argument("--num-classes", type=int, default=0,
+            help="number of node classes, needed with --stream")
+    parser.add_argument("--window", type=float, default=0,
+            help="with --multi-graph, train on onset windows of this length instead of whole pieces, default: 0 [whole pieces]")
+    parser.add_argument("--halo", type=float, default=0,
+            help="onset length of the context added before and after every window")
+    parser.add_argument("--batch-size", type=int, default=0,
+            help="number of seed nodes per neighbor sampled mini-batch, default: 0 [full graph training]")
+    parser.add_argument("--fanout", type=str, default="10",
+            help="sampled neighbors per relation, one value or a comma separated value per layer")
+    parser.add_argument("--sampler-workers", type=int, default=0,
+            help="number of neighbor sampling worker processes")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the dataset pieces in parallel")
+    parser.add_argument("--profile", type=str, default=None,
+            help="append per-epoch timings of the dataset stages, layers, relations, loss, backward and step to this JSON lines file")
+    parser.add_argument("--profile-trace", type=str, default=None,
+            help="export a torch profiler chrome trace of the training loop to this file")
     fp = parser.add_mutually_exclusive_group(required=False)
     fp.add_argument('--validation', dest='validation', action='store_true')
     fp.add_argument('--testing', dest='validation', action='store_false')
     parser.set_defaults(validation=True)
 
     args = parser.parse_args()
+    if args.eval_every < 1:
+        parser.error("--eval-every must be at least 1")
     print(args)
     main(args)
\ No newline at end of file
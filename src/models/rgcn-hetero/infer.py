@@ -0,0 +1,368 @@
+"""Batched inference of a trained RGCN on new pieces
+
+Loads a state dict saved by ``entity_classify.py --model_path`` and scores pieces
+stored in the CSV layout of ``MozartPianoGraphDataset``. Pieces are scored in
+batched ``torch.no_grad()`` forwards, and ``--serve`` keeps the model loaded
+and scores the piece folders read line by line from stdin.
+
+On CPU, ``--quantize`` scores with int8 dynamically quantized relation weights and
+``--bf16`` under bfloat16 autocast. ``--parity`` compares such a model with the
+float32 one on the test pieces of the dataset.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import contextlib
+import copy
+import json
+import os, sys
+import time
+import numpy as np
+import pandas as pd
+import torch as th
+import torch.nn as nn
+import dgl
+import dgl.nn as dglnn
+
+from entity_classify import RGCN, load_dataset
+from utils.nc_dataset_class import FILE_LIST, read_piece, piece_graph
+from utils.partition import partition_graphs, stitch
+
+
+def model_from_state_dict(state_dict):
+    """
+    Rebuild an ``RGCN`` from its state dict.
+
+    The number of layers, the feature sizes and the relation names are read from
+    the ``layers.<i>.mods.<rel>.weight`` entries.
+    """
+    weights = {}
+    for key, value in state_dict.items():
+        parts = key.split(".")
+        if parts[0] == "layers" and parts[2] == "mods" and parts[-1] == "weight":
+            weights.setdefault(int(parts[1]), {})[".".join(parts[3:-1])] = value
+    n_layers = len(weights)
+    rel_names = list(weights[0].keys())
+    in_feats, hid_feats = weights[0][rel_names[0]].shape
+    out_feats = weights[n_layers - 1][rel_names[0]].shape[1]
+    model = RGCN(in_feats, hid_feats, out_feats, rel_names, num_hidden_layers=n_layers - 2)
+    model.load_state_dict(state_dict)
+    return model
+
+
+class LinearGraphConv(nn.Module):
+    """
+    A ``GraphConv`` with its weight matrix in an ``nn.Linear``, so that it can be dynamically quantized.
+
+    The linear map is applied before the message passing when it reduces the feature size and after it
+    otherwise, as ``GraphConv`` does, and the bias and activation after both.
+
+    Parameters
+    ----------
+    conv : dglnn.GraphConv
+        The trained convolution, with its own weight.
+    """
+    def __init__(self, conv):
+        super().__init__()
+        in_feats, out_feats = conv.weight.shape
+        self.apply_first = in_feats > out_feats
+        self.linear = nn.Linear(in_feats, out_feats, bias=False)
+        self.linear.weight.data = conv.weight.data.t().contiguous()
+        self.bias = nn.Parameter(conv.bias.data.clone()) if conv.bias is not None else None
+        self.activation = conv._activation
+        self.conv = dglnn.GraphConv(in_feats, out_feats, norm=conv._norm, weight=False, bias=False,
+                                    allow_zero_in_degree=conv._allow_zero_in_degree)
+
+    def forward(self, graph, feat):
+        if self.apply_first:
+            # the destination features only give the shape of the normalization
+            feat = (self.linear(feat[0].float()), feat[1]) if isinstance(feat, tuple) else self.linear(feat.float())
+            rst = self.conv(graph, feat)
+        else:
+            rst = self.linear(self.conv(graph, feat).float())
+        if self.bias is not None:
+            rst = rst + self.bias
+        if self.activation is not None:
+            rst = self.activation(rst)
+        return rst
+
+
+def quantize_model(model, dtype=th.qint8):
+    """
+    A copy of an ``RGCN`` with the weight matrices of all its relation convolutions dynamically quantized.
+
+    The weights are stored in ``dtype`` and the features quantized on the fly at every forward,
+    the message passing stays in floating point. For CPU inference.
+    """
+    model = copy.deepcopy(model).cpu()
+    for layer in model.layers:
+        for rel in list(layer.mods.keys()):
+            layer.mods[rel] = LinearGraphConv(layer.mods[rel])
+            # newer dgl versions dispatch the relations through a plain dict next to the module dict
+            if hasattr(layer, 'mod_dict'):
+                layer.mod_dict[rel] = layer.mods[rel]
+    return th.quantization.quantize_dynamic(model.eval(), {nn.Linear}, dtype=dtype)
+
+
+class Scorer(object):
+    """
+    A loaded model scoring pieces in batches.
+
+    Parameters
+    ----------
+    model_path : str
+        The saved model state dict, or a training checkpoint whose best weights are loaded.
+    batch_size : int
+        The number of pieces per forward.
+    device : str
+        The device of the forward passes.
+    window : float
+        Score onset windows of this length, batched together, and stitch their predictions,
+        instead of whole pieces. None for whole pieces.
+    halo : float
+        The onset length of the context added before and after every window.
+    quantize : bool
+        Score with int8 dynamically quantized relation weights, see ``quantize_model``. CPU only.
+    bf16 : bool
+        Score under bfloat16 autocast. CPU only.
+    """
+    def __init__(self, model_path, batch_size=16, device='cpu', window=None, halo=0., quantize=False, bf16=False):
+        if (quantize or bf16) and device != 'cpu':
+            raise ValueError("Quantized and bfloat16 inference run on the cpu, got device {}".format(device))
+        if bf16 and not hasattr(th, 'autocast'):
+            raise RuntimeError("bfloat16 inference needs the cpu autocast of torch >= 1.10, got torch {}".format(th.__version__))
+        self.device = device
+        self.batch_size = batch_size
+        self.window = window
+        self.halo = halo
+        self.bf16 = bf16
+        state_dict = th.load(model_path, map_location='cpu')
+        if 'model' in state_dict:
+            # a checkpoint of entity_classify.py --checkpoint
+            state_dict = state_dict['best_model'] if state_dict['best_model'] is not None else state_dict['model']
+        self.model = model_from_state_dict(state_dict).to(device)
+        self.model.eval()
+        in_feats = self.model.layers[0].mods[next(iter(self.model.layers[0].mods.keys()))].weight.shape[0]
+        self.note_columns = ["onset", "duration", "ts", "pitch"] if in_feats == 4 else ["onset", "duration", "pitch"]
+        self.add_inverse_edges = any(rel.endswith("_inv") for rel in self.model.layers[0].mods.keys())
+        if quantize:
+            self.model = quantize_model(self.model)
+
+    def build(self, location):
+        """
+        The graph of the piece CSVs in ``location``.
+        """
+        file_list = [f for f in os.listdir(location) if f.endswith(".csv")] if os.path.isdir(location) else FILE_LIST
+        return piece_graph(read_piece(location, file_list, self.note_columns, self.add_inverse_edges))
+
+    def predict(self, graphs):
+        """
+        Class probabilities of the notes of every graph.
+
+        Returns
+        -------
+        probabilities : list
+            For every graph, the ``(num_notes, num_classes)`` array of its notes.
+        """
+        if self.window is None:
+            return [probs.numpy() for probs in self.forward(graphs)]
+        windows, owners = partition_graphs(graphs, self.window, self.halo)
+        window_probs = self.forward(windows)
+        probabilities = []
+        for i, graph in enumerate(graphs):
+            mine = [k for k, owner in enumerate(owners) if owner == i]
+            probabilities.append(stitch(
+                [windows[k] for k in mine], [window_probs[k] for k in mine], graph.num_nodes('note')).numpy())
+        return probabilities
+
+    def forward(self, graphs):
+        """
+        Class probabilities of the notes of every graph, ``batch_size`` graphs per forward.
+        """
+        probabilities = []
+        autocast = th.autocast('cpu', dtype=th.bfloat16) if self.bf16 else contextlib.nullcontext()
+        with th.no_grad(), autocast:
+            for i in range(0, len(graphs), self.batch_size):
+                bg = dgl.batch(graphs[i:i + self.batch_size]).to(self.device)
+                node_features = {nt: bg.nodes[nt].data['feature'] for nt in bg.ntypes}
+                probs = th.softmax(self.model(bg, node_features)['note'].float(), dim=1).cpu()
+                sizes = bg.batch_num_nodes('note').tolist()
+                probabilities.extend(th.split(probs, sizes))
+        return probabilities
+
+    def score(self, locations):
+        """
+        Build and score pieces.
+
+        Returns
+        -------
+        results : list
+            For every piece a dict with its ``piece`` location, per-note ``predictions`` and
+            ``probabilities``, and its ``build_time`` and ``predict_time`` in seconds.
+            The predict time of a batch is shared equally by its pieces.
+        """
+        results = []
+        for i in range(0, len(locations), self.batch_size):
+            chunk = locations[i:i + self.batch_size]
+            graphs, build_times = [], []
+            for location in chunk:
+                t0 = time.time()
+                graphs.append(self.build(location))
+                build_times.append(time.time() - t0)
+            t0 = time.time()
+            probabilities = self.predict(graphs)
+            predict_time = (time.time() - t0) / len(chunk)
+            for location, probs, build_time in zip(chunk, probabilities, build_times):
+                results.append({
+                    "piece": location, "predictions": probs.argmax(axis=1), "probabilities": probs,
+                    "build_time": build_time, "predict_time": predict_time})
+        return results
+
+
+def write_result(result, out_dir, fmt="csv"):
+    """
+    Write the predictions of a piece to ``out_dir/<piece name>.<fmt>``.
+    """
+    name = os.path.basename(os.path.normpath(result["piece"]))
+    path = os.path.join(out_dir, name + "." + fmt)
+    if fmt == "npy":
+        np.save(path, result["probabilities"])
+    else:
+        df = pd.DataFrame(result["probabilities"], columns=["prob_{}".format(k) for k in range(result["probabilities"].shape[1])])
+        df.insert(0, "prediction", result["predictions"])
+        df.to_csv(path, index_label="note")
+    return path
+
+
+def report(results, out_dir, fmt):
+    for result in results:
+        path = write_result(result, out_dir, fmt) if out_dir is not None else None
+        print(json.dumps({
+            "piece": result["piece"], "notes": int(result["predictions"].shape[0]), "output": path,
+            "build_ms": round(1000 * result["build_time"], 3), "predict_ms": round(1000 * result["predict_time"], 3)}))
+        sys.stdout.flush()
+
+
+def parity(args):
+    """
+    Compare the quantized or bfloat16 model with the float32 model on the test pieces of the dataset.
+
+    Prints for every test piece (and augmented copy) its accuracy and latency in both modes, then a summary
+    with the accuracy delta, the prediction agreement and the latency and throughput gains.
+    Latencies are the best of ``--repeats`` single piece forwards.
+    """
+    dataset = load_dataset(args, multi_graph=True)
+    if args.validation:
+        _, _, test_ids = dataset.piece_split((0.64, 0.16, 0.2), seed=args.seed)
+    else:
+        _, test_ids = dataset.piece_split((0.8, 0.2), seed=args.seed)
+    mode = "+".join(name for name, on in [("int8", args.quantize), ("bf16", args.bf16)] if on)
+    if not mode:
+        raise ValueError("--parity compares --quantize and / or --bf16 with float32, neither is given")
+    scorers = {"float32": Scorer(args.model_path, 1), mode: Scorer(args.model_path, 1, quantize=args.quantize, bf16=args.bf16)}
+
+    def timed(scorer, graph):
+        seconds = []
+        for _ in range(args.repeats):
+            t0 = time.perf_counter()
+            probs = scorer.forward([graph])[0]
+            seconds.append(time.perf_counter() - t0)
+        return probs, min(seconds)
+
+    totals = {name: {"correct": 0, "seconds": 0.} for name in scorers}
+    agree, notes = 0, 0
+    for i in test_ids:
+        graph = dataset[i]
+        labels = graph.nodes['note'].data['labels']
+        row = {"graph": int(i), "piece": dataset.pieces[dataset.graph_pieces[i]], "notes": int(labels.shape[0])}
+        predictions = {}
+        for name, scorer in scorers.items():
+            probs, seconds = timed(scorer, graph)
+            predictions[name] = probs.argmax(dim=1)
+            correct = th.sum(predictions[name] == labels).item()
+            totals[name]["correct"] += correct
+            totals[name]["seconds"] += seconds
+            row[name + "_acc"] = round(correct / len(labels), 4)
+            row[name + "_ms"] = round(1000 * seconds, 3)
+        row["speedup"] = round(row["float32_ms"] / row[mode + "_ms"], 3)
+        agree += th.sum(predictions["float32"] == predictions[mode]).item()
+        notes += len(labels)
+        print(json.dumps(row))
+    acc = {name: total["correct"] / notes for name, total in totals.items()}
+    throughput = {name: notes / total["seconds"] for name, total in totals.items()}
+    print(json.dumps({
+        "mode": mode, "pieces": len({dataset.graph_pieces[i] for i in test_ids}), "graphs": len(test_ids), "notes": notes,
+        "float32_acc": round(acc["float32"], 4), mode + "_acc": round(acc[mode], 4),
+        "acc_delta": round(acc[mode] - acc["float32"], 4), "agreement": round(agree / notes, 4),
+        "float32_notes_per_s": round(throughput["float32"], 1), mode + "_notes_per_s": round(throughput[mode], 1),
+        "speedup": round(throughput[mode] / throughput["float32"], 3)}))
+
+
+def main(args):
+    if args.parity:
+        return parity(args)
+    use_cuda = args.gpu >= 0 and th.cuda.is_available()
+    scorer = Scorer(args.model_path, args.batch_size, 'cuda:%d' % args.gpu if use_cuda else 'cpu',
+                    args.window if args.window > 0 else None, args.halo, args.quantize, args.bf16)
+    if args.out_dir is not None:
+        os.makedirs(args.out_dir, exist_ok=True)
+    if args.pieces:
+        report(scorer.score(args.pieces), args.out_dir, args.format)
+    if args.serve:
+        # Warm process: one or more piece folders per line, scored together.
+        for line in sys.stdin:
+            locations = line.split()
+            if locations:
+                report(scorer.score(locations), args.out_dir, args.format)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RGCN inference')
+    parser.add_argument("--model_path", type=str, required=True,
+            help='path of the saved model')
+    parser.add_argument("--pieces", type=str, nargs='*', default=[],
+            help="piece folders (or urls) in the dataset CSV layout")
+    parser.add_argument("--out-dir", type=str, default=None,
+            help="folder of the per-piece predictions")
+    parser.add_argument("--format", type=str, default="csv", choices=["csv", "npy"],
+            help="csv: prediction and class probabilities per note, npy: class probabilities")
+    parser.add_argument("--batch-size", type=int, default=16,
+            help="number of pieces, or windows with --window, per forward")
+    parser.add_argument("--window", type=float, default=0,
+            help="score onset windows of this length and stitch their predictions, default: 0 [whole pieces]")
+    parser.add_argument("--halo", type=float, default=0,
+            help="onset length of the context added before and after every window")
+    parser.add_argument("--serve", default=False, action='store_true',
+            help="keep the model loaded and score the piece folders read from stdin")
+    parser.add_argument("--gpu", type=int, default=-1,
+            help="gpu")
+    parser.add_argument("--quantize", default=False, action='store_true',
+            help="score with int8 dynamically quantized relation weights, on the cpu")
+    parser.add_argument("--bf16", default=False, action='store_true',
+            help="score under bfloat16 autocast, on the cpu")
+    parser.add_argument("--parity", default=False, action='store_true',
+            help="compare the --quantize / --bf16 model with the float32 model on the test pieces of --dataset")
+    parser.add_argument("-d", "--dataset", type=str, default="mps_cad",
+            help="dataset of the parity check")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the dataset augmentation and of the piece split of the parity check, as in training")
+    parser.add_argument("--compact", type=str, default=None, choices=["float16", "bfloat16"],
+            help="dataset graph mode of the parity check, see entity_classify.py")
+    parser.add_argument("--force-reload", default=False, action='store_true',
+            help="ignore the cached dataset graph and rebuild it from the CSVs")
+    parser.add_argument("--raw-dir", type=str, default=None,
+            help="folder of the pieces, default: the DGL download directory")
+    parser.add_argument("--storage", type=str, default="csv", choices=["csv", "npy"],
+            help="csv: piece CSVs, npy: columnar pieces written by utils.to_columnar in --raw-dir")
+    parser.add_argument("--incremental", default=False, action='store_true',
+            help="cache the graph of every --raw-dir piece and rebuild only the changed pieces")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the dataset pieces in parallel")
+    parser.add_argument("--repeats", type=int, default=3,
+            help="forwards per piece and mode in the parity check, the fastest is reported")
+    fp = parser.add_mutually_exclusive_group(required=False)
+    fp.add_argument('--validation', dest='validation', action='store_true')
+    fp.add_argument('--testing', dest='validation', action='store_false')
+    parser.set_defaults(validation=True, lazy_aug=0)
+    args = parser.parse_args()
+    main(args)
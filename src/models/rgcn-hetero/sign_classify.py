@@ -0,0 +1,212 @@
+"""Entity Classification for Music with precomputed multi-hop features (SIGN)
+
+The relational neighbourhood aggregation of the score graph is computed once,
+per relation and hop, and cached next to the dataset. Training is then a small
+MLP over the precomputed note features, in mini-batches of nodes.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import numpy as np
+import time
+import torch as th
+import torch.nn as nn
+import torch.nn.functional as F
+import os
+import dgl.function as fn
+
+from entity_classify import load_dataset
+
+
+def propagate_features(g, num_hops, category="note"):
+    """
+    Multi-hop propagated features of the predict category nodes.
+
+    For every relation ending in ``category``, the normalized node features are
+    mean-aggregated over the relation neighbours ``num_hops`` times (once for
+    relations between different node types, whose further hops are empty).
+
+    Parameters
+    ----------
+    g : dgl object
+        A heterogenous graph with a 'feature' for every node type.
+    num_hops : int
+        The number of propagation hops.
+    category : str
+        The node type to classify.
+
+    Returns
+    -------
+    features : tensor
+        The ``(N, num_ops, F)`` features of the ``category`` nodes, the raw features first.
+    """
+    feats = {nt: F.normalize(g.nodes[nt].data['feature'].float()) for nt in g.ntypes}
+    ops = [feats[category]]
+    with g.local_scope():
+        for etype in g.canonical_etypes:
+            src, _, dst = etype
+            if dst != category:
+                continue
+            h = feats[src]
+            for hop in range(num_hops if src == dst else 1):
+                g.nodes[src].data['h'] = h
+                g.update_all(fn.copy_u('h', 'm'), fn.mean('m', 'h_out'), etype=etype)
+                h = g.nodes[dst].data.pop('h_out')
+                ops.append(h)
+    return th.stack(ops, dim=1)
+
+
+def load_propagated_features(dataset, g, num_hops, force=False):
+    """
+    The propagated features of ``propagate_features``, cached next to the dataset graph.
+    """
+    path = os.path.join(dataset.save_path, "sign_{}_{}.pt".format(dataset.hash, num_hops))
+    if os.path.exists(path) and not force:
+        return th.load(path)
+    features = propagate_features(g, num_hops, dataset.predict_category)
+    os.makedirs(dataset.save_path, exist_ok=True)
+    th.save(features, path)
+    return features
+
+
+class SIGN(nn.Module):
+    """
+    Scalable Inception Graph Network over precomputed propagated features.
+
+    Parameters
+    ----------
+    in_feats : int
+        The size of the Node Feature Vector
+    num_ops : int
+        The number of precomputed propagation operators.
+    hid_feats : int
+        The size of the Latent Node Feature Representation
+    out_feats : int
+        The number of the node classes we want to predict.
+    dropout : float
+        Dropout probability.
+    """
+    def __init__(self, in_feats, num_ops, hid_feats, out_feats, dropout=0):
+        super().__init__()
+        self.inception = nn.ModuleList([nn.Linear(in_feats, hid_feats) for _ in range(num_ops)])
+        self.project = nn.Sequential(
+            nn.ReLU(), nn.Dropout(dropout),
+            nn.Linear(num_ops * hid_feats, hid_feats), nn.ReLU(), nn.Dropout(dropout),
+            nn.Linear(hid_feats, out_feats))
+
+    def forward(self, x):
+        """
+        Forward Funtion
+
+        Parameters
+        ----------
+        x : tensor
+            The ``(N, num_ops, F)`` precomputed features.
+        """
+        h = th.cat([lin(x[:, i]) for i, lin in enumerate(self.inception)], dim=1)
+        return self.project(h)
+
+
+def evaluate(model, features, labels, idx, batch_size):
+    """
+    Loss and accuracy of the ``idx`` nodes, without gradients.
+    """
+    model.eval()
+    with th.no_grad():
+        logits = th.cat([model(features[idx[i:i + batch_size]]) for i in range(0, len(idx), batch_size)])
+    loss = F.cross_entropy(logits, labels[idx]).item()
+    acc = th.sum(logits.argmax(dim=1) == labels[idx]).item() / len(idx)
+    return loss, acc
+
+
+def main(args):
+    """
+    Main Call for Node Classification with SIGN on Mozart Data.
+
+    """
+    dataset = load_dataset(args)
+    g = dataset[0]
+    category = dataset.predict_category
+    train_idx = th.nonzero(g.nodes[category].data['train_mask'], as_tuple=False).squeeze()
+    test_idx = th.nonzero(g.nodes[category].data['test_mask'], as_tuple=False).squeeze()
+    labels = g.nodes[category].data['labels']
+    if args.validation:
+        val_idx = train_idx[:len(train_idx) // 5]
+        train_idx = train_idx[len(train_idx) // 5:]
+    else:
+        val_idx = train_idx
+
+    t0 = time.time()
+    features = load_propagated_features(dataset, g, args.n_hops, args.force_reload)
+    print("Propagated features {} in {:.4f}s".format(tuple(features.shape), time.time() - t0))
+
+    model = SIGN(features.shape[2], features.shape[1], args.n_hidden, dataset.num_classes, args.dropout)
+    optimizer = th.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.l2norm)
+
+    # training loop
+    print("start training...")
+    dur = []
+    for epoch in range(args.n_epochs):
+        model.train()
+        t0 = time.time()
+        perm = train_idx[th.randperm(len(train_idx))]
+        total_loss = 0.
+        for i in range(0, len(perm), args.batch_size):
+            batch = perm[i:i + args.batch_size]
+            loss = F.cross_entropy(model(features[batch]), labels[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(batch)
+        dur.append(time.time() - t0)
+        val_loss, val_acc = evaluate(model, features, labels, val_idx, args.batch_size)
+        print("Epoch {:05d} | Train Loss: {:.4f} | Valid Acc: {:.4f} | Valid loss: {:.4f} | Time: {:.4f}".
+              format(epoch, total_loss / len(perm), val_acc, val_loss, np.average(dur)))
+    print()
+    if args.model_path is not None:
+        th.save(model.state_dict(), args.model_path)
+
+    test_loss, test_acc = evaluate(model, features, labels, test_idx, args.batch_size)
+    print("Test Acc: {:.4f} | Test loss: {:.4f}| " .format(test_acc, test_loss))
+    print()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SIGN')
+    parser.add_argument("--dropout", type=float, default=0,
+            help="dropout probability")
+    parser.add_argument("--n-hidden", type=int, default=16,
+            help="number of hidden units")
+    parser.add_argument("--n-hops", type=int, default=3,
+            help="number of precomputed propagation hops")
+    parser.add_argument("--lr", type=float, default=1e-2,
+            help="learning rate")
+    parser.add_argument("--batch-size", type=int, default=4096,
+            help="number of nodes per mini-batch")
+    parser.add_argument("-e", "--n-epochs", type=int, default=50,
+            help="number of training epochs")
+    parser.add_argument("-d", "--dataset", type=str, required=True,
+            help="dataset to use")
+    parser.add_argument("--model_path", type=str, default=None,
+            help='path for save the model')
+    parser.add_argument("--l2norm", type=float, default=0,
+            help="l2 norm coef")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the dataset augmentation")
+    parser.add_argument("--force-reload", default=False, action='store_true',
+            help="ignore the cached dataset graph and propagated features and rebuild them")
+    parser.add_argument("--raw-dir", type=str, default=None,
+            help="folder of the pieces, default: the DGL download directory")
+    parser.add_argument("--storage", type=str, default="csv", choices=["csv", "npy"],
+            help="csv: piece CSVs, npy: columnar pieces written by utils.to_columnar in --raw-dir")
+    parser.add_argument("--incremental", default=False, action='store_true',
+            help="cache the graph of every --raw-dir piece and rebuild only the changed pieces")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the dataset pieces in parallel")
+    fp = parser.add_mutually_exclusive_group(required=False)
+    fp.add_argument('--validation', dest='validation', action='store_true')
+    fp.add_argument('--testing', dest='validation', action='store_false')
+    parser.set_defaults(validation=True, lazy_aug=0, compact=None)
+
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -0,0 +1,209 @@
+"""Hyperparameter sweep of the RGCN entity classifier on one in-memory graph
+
+The dataset graph is loaded once and its feature, label and index tensors are
+moved to shared memory. A pool of forked worker processes then trains every
+configuration of the grid concurrently on that single copy, with early stopping
+on the validation accuracy, and the trials are reported as a table.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import argparse
+import copy
+import itertools
+import os
+import time
+import pandas as pd
+import torch as th
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+
+from entity_classify import RGCN, load_dataset
+
+
+# The graph and tensors shared with the forked workers.
+_SHARED = dict()
+
+
+def share_graph(g, category, validation=True):
+    """
+    Pop the labels and masks of ``g`` and move every tensor the trials read to shared memory.
+
+    Parameters
+    ----------
+    g : dgl object
+        The batched dataset graph.
+    category : str
+        The node type to classify.
+    validation : bool
+        Hold out the first fifth of the training nodes for validation, as ``entity_classify.py``.
+
+    Returns
+    -------
+    shared : dict
+        The graph, node features, labels and train, validation and test indices.
+    """
+    train_idx = th.nonzero(g.nodes[category].data.pop('train_mask'), as_tuple=False).squeeze()
+    test_idx = th.nonzero(g.nodes[category].data.pop('test_mask'), as_tuple=False).squeeze()
+    labels = g.nodes[category].data.pop('labels')
+    if validation:
+        val_idx = train_idx[:len(train_idx) // 5]
+        train_idx = train_idx[len(train_idx) // 5:]
+    else:
+        val_idx = train_idx
+    # build the sparse formats once, instead of once per worker
+    g.create_formats_()
+    node_features = {nt: g.nodes[nt].data['feature'].share_memory_() for nt in g.ntypes}
+    return {
+        "graph": g,
+        "category": category,
+        "node_features": node_features,
+        "labels": labels.share_memory_(),
+        "train_idx": train_idx.share_memory_(),
+        "val_idx": val_idx.share_memory_(),
+        "test_idx": test_idx.share_memory_(),
+    }
+
+
+def evaluate(model, idx):
+    model.eval()
+    with th.no_grad():
+        logits = model(_SHARED["graph"], _SHARED["node_features"])[_SHARED["category"]][idx]
+        labels = _SHARED["labels"][idx]
+        loss = F.cross_entropy(logits, labels).item()
+        acc = th.sum(logits.argmax(dim=1) == labels).item() / len(idx)
+    return loss, acc
+
+
+def run_trial(config):
+    """
+    Train one configuration on the shared graph, stopping after ``patience`` epochs without a better validation accuracy.
+
+    Returns
+    -------
+    result : dict
+        The configuration with the best epoch, its validation and test metrics, the number of epochs and the seconds.
+    """
+    g, category = _SHARED["graph"], _SHARED["category"]
+    labels, train_idx = _SHARED["labels"], _SHARED["train_idx"]
+    th.manual_seed(config["seed"])
+    in_feats = _SHARED["node_features"][g.ntypes[0]].shape[1]
+    model = RGCN(in_feats, config["n_hidden"], _SHARED["num_classes"], g.etypes, num_hidden_layers=config["n_layers"] - 2)
+    optimizer = th.optim.Adam(model.parameters(), lr=config["lr"], weight_decay=config["l2norm"])
+
+    t0 = time.time()
+    best = {"val_acc": -1.}
+    best_state = None
+    for epoch in range(config["n_epochs"]):
+        model.train()
+        logits = model(g, _SHARED["node_features"])[category]
+        loss = F.cross_entropy(logits[train_idx], labels[train_idx])
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        val_loss, val_acc = evaluate(model, _SHARED["val_idx"])
+        if val_acc > best["val_acc"]:
+            best = {"best_epoch": epoch, "train_loss": loss.item(), "val_loss": val_loss, "val_acc": val_acc}
+            best_state = copy.deepcopy(model.state_dict())
+        elif epoch - best["best_epoch"] >= config["patience"]:
+            break
+    model.load_state_dict(best_state)
+    test_loss, test_acc = evaluate(model, _SHARED["test_idx"])
+    return dict(config, epochs=epoch + 1, seconds=time.time() - t0, test_loss=test_loss, test_acc=test_acc, **best)
+
+
+def _init_worker(num_threads):
+    th.set_num_threads(num_threads)
+
+
+def sweep_grid(args):
+    """
+    Every configuration of the comma separated values of the sweep arguments.
+    """
+    grid = {
+        "n_hidden": [int(v) for v in args.n_hidden.split(',')],
+        "n_layers": [int(v) for v in args.n_layers.split(',')],
+        "lr": [float(v) for v in args.lr.split(',')],
+        "l2norm": [float(v) for v in args.l2norm.split(',')],
+    }
+    configs = []
+    for values in itertools.product(*grid.values()):
+        config = dict(zip(grid.keys(), values))
+        config.update(n_epochs=args.n_epochs, patience=args.patience, seed=args.seed)
+        configs.append(config)
+    return configs
+
+
+def main(args):
+    """
+    Main Call for the hyperparameter sweep of the RGCN on Mozart Data.
+
+    """
+    t0 = time.time()
+    dataset = load_dataset(args)
+    _SHARED.update(share_graph(dataset[0], dataset.predict_category, args.validation), num_classes=dataset.num_classes)
+    print("Loaded and shared the graph in {:.4f}s".format(time.time() - t0))
+
+    configs = sweep_grid(args)
+    num_threads = args.num_threads if args.num_threads > 0 else max(1, (os.cpu_count() or 1) // args.workers)
+    print("Running {} trials on {} workers of {} threads...".format(len(configs), args.workers, num_threads))
+    t0 = time.time()
+    results = []
+    with mp.get_context("fork").Pool(args.workers, initializer=_init_worker, initargs=(num_threads,)) as pool:
+        for result in pool.imap_unordered(run_trial, configs):
+            print("Trial | n_hidden {n_hidden} | n_layers {n_layers} | lr {lr} | l2norm {l2norm} | "
+                  "Valid Acc: {val_acc:.4f} | Epochs: {epochs} | Time: {seconds:.4f}".format(**result))
+            results.append(result)
+    print("Swept {} trials in {:.4f}s".format(len(results), time.time() - t0))
+    print()
+
+    table = pd.DataFrame(results).sort_values("val_acc", ascending=False)
+    columns = ["n_hidden", "n_layers", "lr", "l2norm", "best_epoch", "epochs", "val_acc", "val_loss", "test_acc", "seconds"]
+    print(table[columns].to_string(index=False))
+    if args.results is not None:
+        table.to_csv(args.results, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RGCN hyperparameter sweep')
+    parser.add_argument("--n-hidden", type=str, default="16",
+            help="comma separated numbers of hidden units")
+    parser.add_argument("--n-layers", type=str, default="2",
+            help="comma separated numbers of propagation rounds")
+    parser.add_argument("--lr", type=str, default="1e-2",
+            help="comma separated learning rates")
+    parser.add_argument("--l2norm", type=str, default="0",
+            help="comma separated l2 norm coefs")
+    parser.add_argument("-e", "--n-epochs", type=int, default=50,
+            help="maximum number of training epochs per trial")
+    parser.add_argument("--patience", type=int, default=10,
+            help="stop a trial after this many epochs without a better validation accuracy")
+    parser.add_argument("-d", "--dataset", type=str, required=True,
+            help="dataset to use")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the dataset augmentation and of the model initialization")
+    parser.add_argument("--force-reload", default=False, action='store_true',
+            help="ignore the cached dataset graph and rebuild it from the CSVs")
+    parser.add_argument("--raw-dir", type=str, default=None,
+            help="folder of the pieces, default: the DGL download directory")
+    parser.add_argument("--storage", type=str, default="csv", choices=["csv", "npy"],
+            help="csv: piece CSVs, npy: columnar pieces written by utils.to_columnar in --raw-dir")
+    parser.add_argument("--incremental", default=False, action='store_true',
+            help="cache the graph of every --raw-dir piece and rebuild only the changed pieces")
+    parser.add_argument("--compact", type=str, default=None, choices=["float16", "bfloat16"],
+            help="store the graph with int32 ids and the node features in this type, default: None [int64 ids, float32 features]")
+    parser.add_argument("--num-workers", type=int, default=0,
+            help="number of processes building the dataset pieces in parallel")
+    parser.add_argument("--workers", type=int, default=4,
+            help="number of trials trained concurrently")
+    parser.add_argument("--num-threads", type=int, default=0,
+            help="torch threads per trial, default: 0 [cores / workers]")
+    parser.add_argument("--results", type=str, default=None,
+            help="write the results table to this CSV file")
+    fp = parser.add_mutually_exclusive_group(required=False)
+    fp.add_argument('--validation', dest='validation', action='store_true')
+    fp.add_argument('--testing', dest='validation', action='store_false')
+    parser.set_defaults(validation=True, lazy_aug=0)
+
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -1 +1,4 @@
-from .nc_dataset_class import MPGD_cad, MPGD_onset
\ No newline at end of file
+from .nc_dataset_class import MPGD_cad, MPGD_onset
+from .profiling import Profiler, NULL_PROFILER, torch_trace
+from .partition import onset_windows, partition_graphs, stitch
+from .prefetch import PiecePipeline
@@ -1,11 +1,17 @@
 import os
+import hashlib
+import json
 import numpy as np
 import torch as torch
 from torch import tensor
 import pandas as pd
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 import dgl
 from dgl.data import DGLDataset
+from dgl.data.utils import get_download_dir, save_info, load_info
+from .profiling import NULL_PROFILER
 
 
 PIECE_LIST = [
@@ -28,165 +34,642 @@ FILE_LIST = [
 	'note.csv', 'rest-follows-note.csv', 'rest.csv'	
 	]
 
+CAD_URL = "https://raw.githubusercontent.com/melkisedeath/tonnetzcad/main/node_classification/mps_ts_att_cadlab"
+ONSET_URL = "https://raw.githubusercontent.com/melkisedeath/tonnetzcad/main/node_classification/mps_ts_att_onlab/"
+
+# Augmentation choices: time resize factors and transpositions in semitones.
+RESIZE_FACTORS = [0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2, 2.5]
+TRANSPOSITIONS = range(-6, 6, 1)
+
+# Node feature storage types of the compact mode.
+COMPACT_DTYPES = {"float16": torch.float16, "bfloat16": torch.bfloat16}
+
+def _labels(nodes):
+	if 'label' not in nodes:
+		return torch.zeros(nodes.shape[0], dtype=torch.long)
+	return torch.from_numpy(nodes['label'].astype('category').cat.codes.to_numpy()).long()
+
+
+def read_piece(location, file_list, note_columns, add_inverse_edges=False):
+	"""
+	Read the CSVs of one piece.
+
+	Parameters
+	----------
+	location : str
+		The piece folder, a local path or an url.
+	file_list : list
+		The CSV files of the piece.
+	note_columns : list
+		The note feature columns. Rests take the same columns without pitch, padded with zeros.
+	add_inverse_edges : bool
+		Add a reversed ``<rel>_inv`` relation for every relation.
+
+	Returns
+	-------
+	piece : dict
+		The ``edges`` dictionary for ``dgl.heterograph`` and the
+		``(features, labels)`` tensors of the ``note`` and ``rest`` nodes.
+		Unlabelled pieces get zero labels.
+	"""
+	rest_columns = [c for c in note_columns if c != "pitch"]
+	edge_dict = dict()
+	for csv in file_list:
+		path = location + "/" + csv
+		if csv == "note.csv":
+			notes = pd.read_csv(path)
+			note_node_features = torch.from_numpy(notes[note_columns].to_numpy())
+			note_node_labels = _labels(notes)
+		elif csv == "rest.csv":      
+			rests = pd.read_csv(path)
+			a = rests[rest_columns].to_numpy()
+			rest_node_features = torch.from_numpy(np.hstack((a,np.zeros((a.shape[0],1)))))
+			rest_node_labels = _labels(rests)
+		else :
+			name = tuple(csv.split(".")[0].split("-"))
+			edges_data = pd.read_csv(path)
+			if edges_data.empty:   
+				edges_src = torch.tensor([0])
+				edges_dst = torch.tensor([0])       				
+			else :
+				edges_src = torch.from_numpy(edges_data['src'].to_numpy())
+				edges_dst = torch.from_numpy(edges_data['des'].to_numpy())
+			edge_dict[name] = (edges_src, edges_dst)
+			if add_inverse_edges:
+				inv_name = (name[2], name[1]+"_inv", name[0])
+				edge_dict[inv_name] = (edges_dst, edges_src)
+	return {
+		"edges": edge_dict,
+		"note": (note_node_features.float(), note_node_labels),
+		"rest": (rest_node_features.float(), rest_node_labels),
+		}
+
+
+def piece_graph(piece, note_features=None):
+	"""
+	Build the heterograph of a piece read by ``read_piece``.
+
+	Parameters
+	----------
+	piece : dict
+		The piece edges and node data.
+	note_features : tensor
+		Replace the note features, e.g. by an augmented version.
+	"""
+	note_node_features, note_node_labels = piece["note"]
+	rest_node_features, rest_node_labels = piece["rest"]
+	if note_features is None:
+		note_features = note_node_features
+	graph = dgl.heterograph(piece["edges"], num_nodes_dict={"note" : note_node_features.shape[0], "rest" : rest_node_features.shape[0]})
+	graph.nodes['note'].data['feature'] = note_features
+	graph.nodes['note'].data['labels'] = note_node_labels
+	graph.nodes['rest'].data['feature'] = rest_node_features
+	graph.nodes['rest'].data['labels'] = rest_node_labels
+	return graph
+
+
+def compact_graph(graph, feature_dtype=torch.float16):
+	"""
+	The graph with int32 node and edge ids and its node features stored as ``feature_dtype``.
+
+	The models upcast the features to float32 at their input.
+	"""
+	graph = graph.int()
+	for ntype in graph.ntypes:
+		graph.nodes[ntype].data['feature'] = graph.nodes[ntype].data['feature'].to(feature_dtype)
+	return graph
+
+
+def add_inverse_relations(graph):
+	"""
+	Add a reversed ``<rel>_inv`` relation for every relation of a graph, from the forward edge arrays.
+
+	The inverse relations are separate relations of the new graph, so their edges are stored again
+	as in ``read_piece``. Node data and batch information are kept.
+	"""
+	edge_dict = dict()
+	batch_num_edges = dict()
+	for name in graph.canonical_etypes:
+		edges_src, edges_dst = graph.edges(etype=name)
+		inv_name = (name[2], name[1]+"_inv", name[0])
+		edge_dict[name] = (edges_src, edges_dst)
+		edge_dict[inv_name] = (edges_dst, edges_src)
+		batch_num_edges[name] = batch_num_edges[inv_name] = graph.batch_num_edges(name)
+	inverse = dgl.heterograph(edge_dict, num_nodes_dict={ntype: graph.num_nodes(ntype) for ntype in graph.ntypes}, idtype=graph.idtype)
+	for ntype in graph.ntypes:
+		inverse.nodes[ntype].data.update(graph.nodes[ntype].data)
+	inverse.set_batch_num_nodes({ntype: graph.batch_num_nodes(ntype) for ntype in graph.ntypes})
+	inverse.set_batch_num_edges(batch_num_edges)
+	return inverse
+
+
+def augment_piece(piece, rng, n_aug=5):
+	"""
+	Duration resized and transposed copies of a piece with 4 note features.
+
+	Parameters
+	----------
+	piece : dict
+		The piece edges and node data.
+	rng : random.Random
+		The random generator of the resize factor and the transposition.
+	n_aug : int
+		The number of draws. Draws that leave the piece unchanged are skipped.
+
+	Returns
+	-------
+	graphs : list
+		The augmented heterographs.
+	"""
+	graphs = list()
+	for _ in range(n_aug):
+		resize_factor = rng.choice(RESIZE_FACTORS)
+		n = rng.choice(TRANSPOSITIONS)
+		if resize_factor != 1 or n != 0:
+			dur_resize = torch.tensor([resize_factor, resize_factor, resize_factor, 1]).float()
+			pitch_aug = torch.tensor([0, 0 , 0, n]).float()
+			graphs.append(piece_graph(piece, piece["note"][0]*dur_resize + pitch_aug))
+	return graphs
+
+
+class LazyAugmentation(object):
+	"""
+	Duration resize and transposition of note features drawn on the fly.
+
+	Instead of materializing augmented graph copies, the transforms are applied to the
+	note features of a single graph, with one random draw per piece and variant.
+	All timing columns are resized and the last (pitch) column is transposed.
+
+	Parameters
+	----------
+	num_variants : int
+		The default number of variants drawn per call.
+	seed : int
+		The seed of the draws.
+	"""
+	def __init__(self, num_variants=5, seed=0):
+		self.num_variants = num_variants
+		self.generator = torch.Generator().manual_seed(seed)
+		self.resize_factors = torch.tensor(RESIZE_FACTORS).float()
+		self.transpositions = torch.tensor(list(TRANSPOSITIONS)).float()
+
+	def sample(self, num_pieces, num_variants=None):
+		"""
+		Draw a resize factor and a transposition for every variant and piece.
+
+		Returns
+		-------
+		resize, transpose : tensor
+			Two ``(num_variants, num_pieces)`` tensors.
+		"""
+		num_variants = self.num_variants if num_variants is None else num_variants
+		resize = self.resize_factors[torch.randint(len(self.resize_factors), (num_variants, num_pieces), generator=self.generator)]
+		transpose = self.transpositions[torch.randint(len(self.transpositions), (num_variants, num_pieces), generator=self.generator)]
+		return resize, transpose
+
+	def __call__(self, features, piece, num_variants=None):
+		"""
+		Augmented versions of the note features.
+
+		Parameters
+		----------
+		features : tensor
+			The ``(N, F)`` note features, pitch last.
+		piece : tensor
+			The ``(N,)`` piece index of every note.
+		num_variants : int
+			The number of variants.
+
+		Returns
+		-------
+		features : tensor
+			The ``(num_variants, N, F)`` augmented features.
+		"""
+		resize, transpose = self.sample(int(piece.max().item()) + 1, num_variants)
+		is_pitch = torch.zeros(features.shape[1], dtype=torch.bool, device=features.device)
+		is_pitch[-1] = True
+		resize = resize.to(features.device)[:, piece].unsqueeze(-1)
+		transpose = transpose.to(features.device)[:, piece].unsqueeze(-1)
+		scale = torch.where(is_pitch, torch.ones_like(resize), resize)
+		shift = torch.where(is_pitch, transpose, torch.zeros_like(transpose))
+		# One fused multiply-add over every variant, in float32 for compact features.
+		return torch.addcmul(shift, features.float().unsqueeze(0), scale)
+
+
+def save_columnar_piece(piece, location):
+	"""
+	Write a piece read by ``read_piece`` as one ``.npy`` array per column.
+
+	Node features are stored as float32 and labels as int64 in ``<ntype>.feature.npy``
+	and ``<ntype>.labels.npy``. Every relation ``<src>-<rel>-<dst>`` is stored as int32
+	``<src>-<rel>-<dst>.src.npy`` and ``<src>-<rel>-<dst>.des.npy``. Inverse relations are
+	not stored, ``load_columnar_piece`` derives them from the forward arrays.
+
+	Parameters
+	----------
+	piece : dict
+		The piece edges and node data.
+	location : str
+		The output piece folder.
+	"""
+	os.makedirs(location, exist_ok=True)
+	for ntype in ["note", "rest"]:
+		features, labels = piece[ntype]
+		np.save(os.path.join(location, ntype + ".feature.npy"), features.numpy().astype(np.float32))
+		np.save(os.path.join(location, ntype + ".labels.npy"), labels.numpy().astype(np.int64))
+	for name, (edges_src, edges_dst) in piece["edges"].items():
+		if name[1].endswith("_inv"):
+			continue
+		np.save(os.path.join(location, "-".join(name) + ".src.npy"), edges_src.numpy().astype(np.int32))
+		np.save(os.path.join(location, "-".join(name) + ".des.npy"), edges_dst.numpy().astype(np.int32))
+
+
+def _load_array(path, mmap=True):
+	if mmap:
+		try:
+			# Copy-on-write mapping: pages are shared through the page cache and never written back.
+			return torch.from_numpy(np.load(path, mmap_mode="c"))
+		except ValueError:
+			# Older numpy versions cannot map empty arrays.
+			pass
+	return torch.from_numpy(np.load(path))
+
+
+def load_columnar_piece(location, add_inverse_edges=False, mmap=True):
+	"""
+	Read a piece written by ``save_columnar_piece``.
+
+	The arrays are memory-mapped and handed to ``dgl.heterograph`` without copying,
+	the resulting graph has int32 indices.
+
+	Parameters
+	----------
+	location : str
+		The local piece folder.
+	add_inverse_edges : bool
+		Add a reversed ``<rel>_inv`` relation for every relation, sharing the forward arrays.
+	mmap : bool
+		Memory-map the arrays instead of reading them.
+
+	Returns
+	-------
+	piece : dict
+		The piece edges and node data as returned by ``read_piece``.
+	"""
+	piece = dict()
+	for ntype in ["note", "rest"]:
+		piece[ntype] = (
+			_load_array(os.path.join(location, ntype + ".feature.npy"), mmap),
+			_load_array(os.path.join(location, ntype + ".labels.npy"), mmap))
+	edge_dict = dict()
+	for fn in sorted(os.listdir(location)):
+		if not fn.endswith(".src.npy"):
+			continue
+		rel = fn[:-len(".src.npy")]
+		name = tuple(rel.split("-"))
+		edges_src = _load_array(os.path.join(location, fn), mmap)
+		edges_dst = _load_array(os.path.join(location, rel + ".des.npy"), mmap)
+		edge_dict[name] = (edges_src, edges_dst)
+		if add_inverse_edges:
+			inv_name = (name[2], name[1]+"_inv", name[0])
+			edge_dict[inv_name] = (edges_dst, edges_src)
+	piece["edges"] = edge_dict
+	return piece
+
+
+def load_piece_graphs(location, file_list, note_columns, add_inverse_edges=False, aug_seed=None, timings=None):
+	"""
+	Read a piece and build its graph followed by its augmented graphs.
+
+	Parameters
+	----------
+	location : str
+		The piece folder, a local path or an url.
+	file_list : list
+		The CSV files of the piece, None for a piece in columnar ``.npy`` layout.
+	note_columns : list
+		The note feature columns.
+	add_inverse_edges : bool
+		Add a reversed ``<rel>_inv`` relation for every relation.
+	aug_seed : str
+		Seed of the piece augmentations, None for no augmentation.
+	timings : dict
+		Accumulate the seconds spent in the 'parse', 'build' and 'augment' stages.
+	"""
+	t0 = time.perf_counter()
+	if file_list is None:
+		piece = load_columnar_piece(location, add_inverse_edges)
+	else:
+		piece = read_piece(location, file_list, note_columns, add_inverse_edges)
+	t1 = time.perf_counter()
+	graphs = [piece_graph(piece)]
+	t2 = time.perf_counter()
+	if aug_seed is not None and piece["note"][0].shape[1] == 4:
+		graphs.extend(augment_piece(piece, random.Random(aug_seed)))
+	if timings is not None:
+		for stage, seconds in [("parse", t1 - t0), ("build", t2 - t1), ("augment", time.perf_counter() - t2)]:
+			timings[stage] = timings.get(stage, 0.) + seconds
+	return graphs
+
+
+def _init_worker():
+	# One intra-op thread per worker process, the pool provides the parallelism.
+	torch.set_num_threads(1)
+
+
+def _load_task(task):
+	_, location, file_list, note_columns, aug_seed, add_inverse_edges = task
+	timings = dict()
+	return load_piece_graphs(location, file_list, note_columns, add_inverse_edges, aug_seed, timings), timings
+
+
+def build_piece_graphs(tasks, add_inverse_edges=False, num_workers=0, timings=None):
+	"""
+	Build the graphs of many pieces, in parallel when ``num_workers > 1``.
+
+	Parameters
+	----------
+	tasks : list
+		``(piece, location, file_list, note_columns, aug_seed)`` tuples.
+	add_inverse_edges : bool
+		Add a reversed ``<rel>_inv`` relation for every relation.
+	num_workers : int
+		The number of worker processes.
+	timings : dict
+		Accumulate the seconds spent in every stage of ``load_piece_graphs``, summed over the workers.
+
+	Returns
+	-------
+	piece_graphs : list
+		For every task, in the order of ``tasks``, the list of its graphs.
+	"""
+	tasks = [tuple(task) + (add_inverse_edges,) for task in tasks]
+	if num_workers > 1 and len(tasks) > 1:
+		with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker) as pool:
+			results = list(pool.map(_load_task, tasks))
+	else:
+		results = [_load_task(task) for task in tasks]
+	if timings is not None:
+		for _, task_timings in results:
+			for stage, seconds in task_timings.items():
+				timings[stage] = timings.get(stage, 0.) + seconds
+	return [graphs for graphs, _ in results]
+
+
+def piece_tasks(url, raw_dir, select_piece=None, storage="csv", aug_seed=None):
+	"""
+	The pieces to read, as the ``(piece, location, file_list, note_columns, aug_seed)`` tasks of ``build_piece_graphs``.
+
+	Parameters
+	----------
+	url : str
+		The location of the piece CSVs of ``PIECE_LIST``.
+	raw_dir : str
+		A local directory of piece folders, used instead of ``url`` when its path contains 'mozart'
+		or when ``storage`` is 'npy'.
+	select_piece : str
+		Only read this piece.
+	storage : str
+		'csv' or 'npy', see ``MozartPianoGraphDataset``.
+	aug_seed : callable
+		The augmentation seed of a piece name, None for no augmentation.
+	"""
+	aug_seed = aug_seed or (lambda fn: None)
+	tasks = list()
+	if storage == "npy":
+		for fn in MozartPianoGraphDataset.piece_names(url, raw_dir, select_piece, storage):
+			tasks.append((fn, os.path.join(raw_dir, fn), None, None, aug_seed(fn)))
+	elif select_piece and select_piece in PIECE_LIST:
+		tasks.append((select_piece, url + "/" + select_piece, FILE_LIST, ["onset", "duration", "pitch"], None))
+	else:
+		if 'mozart' in raw_dir : 
+			print(raw_dir)    
+			if all([os.path.isdir(os.path.join(raw_dir, fn)) for fn in os.listdir(raw_dir)]):
+				for fn in MozartPianoGraphDataset.piece_names(url, raw_dir):
+					location = os.path.join(raw_dir, fn)
+					tasks.append((fn, location, os.listdir(location), ["onset", "duration", "pitch"], None))
+		else:    
+			for fn in PIECE_LIST:
+				# Perform Data Augmentation
+				tasks.append((fn, url + "/" + fn, FILE_LIST, ["onset", "duration", "ts", "pitch"], aug_seed(fn)))
+	return tasks
+
+
+def piece_parts(num_pieces, fractions, seed=0):
+	"""
+	Randomly assign pieces to parts of the given fractions.
+
+	Returns
+	-------
+	part_of_piece : dict
+		The part index of every piece index.
+	"""
+	order = list(range(num_pieces))
+	random.Random(seed).shuffle(order)
+	bounds = np.round(np.cumsum([0] + list(fractions)) * len(order)).astype(int)
+	part_of_piece = dict()
+	for k in range(len(fractions)):
+		for p in order[bounds[k]:bounds[k+1]]:
+			part_of_piece[p] = k
+	return part_of_piece
+
+
+def _file_hash(path):
+	digest = hashlib.sha1()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def piece_fingerprint(location, previous=None):
+	"""
+	The size, mtime and content hash of every file of a local piece folder.
+
+	Parameters
+	----------
+	location : str
+		The local piece folder.
+	previous : dict
+		An earlier fingerprint of the folder. The hashes of its files whose size and mtime
+		did not change are reused instead of reading the files again.
+
+	Returns
+	-------
+	files : dict
+		For every file name, its 'size', 'mtime' (in ns) and 'sha1'.
+	"""
+	previous = previous or dict()
+	files = dict()
+	for fn in sorted(os.listdir(location)):
+		stat = os.stat(os.path.join(location, fn))
+		entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+		old = previous.get(fn)
+		if old is not None and old["size"] == entry["size"] and old["mtime"] == entry["mtime"]:
+			entry["sha1"] = old["sha1"]
+		else:
+			entry["sha1"] = _file_hash(os.path.join(location, fn))
+		files[fn] = entry
+	return files
+
+
+def _same_stat(location, files):
+	# Cheap check of a fingerprint: same files with the same size and mtime.
+	if not os.path.isdir(location) or sorted(os.listdir(location)) != sorted(files):
+		return False
+	for fn, entry in files.items():
+		stat = os.stat(os.path.join(location, fn))
+		if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime"]:
+			return False
+	return True
+
+
+def _same_content(files, other):
+	return other is not None and {fn: e["sha1"] for fn, e in files.items()} == {fn: e["sha1"] for fn, e in other.items()}
+
+
 class MozartPianoGraphDataset(DGLDataset):
-	def __init__(self, name, url, raw_dir=None, add_inverse_edges=False, add_aug=True, select_piece=None):
+	"""
+	Mozart Piano Sonatas score graphs for node classification.
+
+	The processed graph is cached in DGL's binary graph format under ``save_dir``,
+	keyed by a hash of the source location, the piece list, ``add_inverse_edges``,
+	``add_aug`` and ``seed``, so repeated runs skip CSV parsing and graph building.
+
+	Parameters
+	----------
+	name : str
+		The dataset name, also the cache sub-directory.
+	url : str
+		The remote location of the piece CSVs.
+	raw_dir : str
+		A local directory of piece folders. Used instead of ``url`` when its path contains 'mozart'
+		or when ``storage`` is 'npy'.
+	save_dir : str
+		Where to keep the cache. Defaults to the DGL download directory.
+	add_inverse_edges : bool
+		Add a reversed ``<rel>_inv`` relation for every relation.
+	add_aug : bool
+		Add 5 duration resized / transposed copies of every piece.
+	lazy_aug : bool
+		With ``add_aug``, keep a single copy of every piece and expose a ``LazyAugmentation``
+		as ``augmentation`` to transform the note features during training.
+	select_piece : str
+		Only load this piece.
+	multi_graph : bool
+		Expose one graph per piece and augmented copy instead of a single batched graph.
+		Use ``piece_split`` for train / test splits.
+	storage : str
+		'csv' for the CSV pieces, 'npy' for pieces converted to the columnar layout
+		of ``save_columnar_piece`` (see ``utils.to_columnar``) in ``raw_dir``.
+	seed : int
+		Seed of the augmentation sampling.
+	num_workers : int
+		The number of processes reading and building pieces in parallel.
+		The result does not depend on it.
+	profiler : Profiler
+		Times the 'dataset/parse', 'dataset/build', 'dataset/augment' and 'dataset/batch' stages of process().
+	compact : str
+		Store the graphs with int32 ids and the node features as 'float16' or 'bfloat16'. Inverse relations
+		are then added to the batched graph (every piece graph in ``multi_graph`` mode) after compaction. They
+		still store every edge twice, as without ``compact``. None keeps int64 ids and float32 features.
+	incremental : bool
+		Keep the graphs of every local piece folder (``raw_dir`` pieces) in a per-piece cache, with a manifest
+		of the size, mtime and content hash of their files. A changed, added or removed piece invalidates the
+		dataset cache, and process() only rebuilds the changed and new pieces.
+	force_reload : bool
+		Ignore the cache, including the per-piece cache of ``incremental``, and rebuild the graph.
+	verbose : bool
+		Print cache information.
+	"""
+	def __init__(self, name, url, raw_dir=None, save_dir=None, add_inverse_edges=False, add_aug=True, lazy_aug=False, select_piece=None, multi_graph=False, storage="csv", seed=0, num_workers=0, profiler=None, compact=None, incremental=False, force_reload=False, verbose=False):
+		if compact is not None and compact not in COMPACT_DTYPES:
+			raise ValueError("compact must be one of {}, got {}".format(list(COMPACT_DTYPES), compact))
 		self.add_inverse_edges = add_inverse_edges
+		self.compact = compact
+		self.profiler = NULL_PROFILER if profiler is None else profiler
+		self.multi_graph = multi_graph
+		self.storage = storage
+		self.num_workers = num_workers
 		self.add_aug = add_aug
+		self.lazy_aug = lazy_aug
+		self.augmentation = LazyAugmentation(seed=seed) if add_aug and lazy_aug else None
 		self.select_piece = select_piece
+		self.seed = seed
+		self.incremental = incremental
+		if raw_dir is None:
+			raw_dir = get_download_dir()
+		if save_dir is None:
+			save_dir = get_download_dir()
+		hash_key = (url, raw_dir, storage, tuple(self.piece_names(url, raw_dir, select_piece, storage)), add_inverse_edges, add_aug, lazy_aug, multi_graph, seed, compact)
 		# url = "https://raw.githubusercontent.com/melkisedeath/tonnetzcad/main/node_classification/mozart_piano_sonatas/"
-		super().__init__(name=name, raw_dir=raw_dir, url=url)
+		super().__init__(name=name, raw_dir=raw_dir, url=url, save_dir=save_dir, hash_key=hash_key, force_reload=force_reload, verbose=verbose)
+
+	@staticmethod
+	def piece_names(url, raw_dir, select_piece=None, storage="csv"):
+		"""
+		The pieces process() reads, in order.
+		"""
+		if storage == "npy":
+			return [select_piece] if select_piece else sorted(os.listdir(raw_dir))
+		if select_piece and select_piece in PIECE_LIST:
+			return [select_piece]
+		if 'mozart' in raw_dir and os.path.isdir(raw_dir):
+			return sorted(os.listdir(raw_dir))
+		return PIECE_LIST
+
+	def aug_seed(self, fn):
+		"""
+		The seed of the materialized augmentations of a piece, None without them.
+		"""
+		if self.add_aug and not self.lazy_aug:
+			return "{}-{}".format(self.seed, fn)
+		return None
 
 	def process(self):
 		self.PIECE_LIST = PIECE_LIST
 		self.FILE_LIST = FILE_LIST
-		if self.select_piece and self.select_piece in self.PIECE_LIST:
-			edge_dict = dict()
-			for csv in self.FILE_LIST:
-				path = self.url + "/" + self.select_piece + "/" + csv
-				if csv == "note.csv":
-					notes = pd.read_csv(path)
-					note_node_features = torch.from_numpy(notes[["onset", "duration", "pitch"]].to_numpy())
-					note_node_labels = torch.from_numpy(notes['label'].astype('category').cat.codes.to_numpy()).long()
-				elif csv == "rest.csv":      
-					rests = pd.read_csv(path)
-					a = rests[["onset", "duration"]].to_numpy()
-					rest_node_features = torch.from_numpy(np.hstack((a,np.zeros((a.shape[0],1)))))
-					rest_node_labels = torch.from_numpy(rests['label'].astype('category').cat.codes.to_numpy()).long()
-				else :
-					name = tuple(csv.split(".")[0].split("-"))
-					edges_data = pd.read_csv(path)
-					if edges_data.empty:   
-						edges_src = torch.tensor([0])
-						edges_dst = torch.tensor([0])       				
-					else :
-						edges_src = torch.from_numpy(edges_data['src'].to_numpy())
-						edges_dst = torch.from_numpy(edges_data['des'].to_numpy())
-					edge_dict[name] = (edges_src, edges_dst)
-					if self.add_inverse_edges:
-						inv_name = (name[2], name[1]+"_inv", name[0])
-						edge_dict[inv_name] = (edges_dst, edges_src)
-
-			self.graph = dgl.heterograph(edge_dict, num_nodes_dict={"note" : notes.shape[0], "rest" :rests.shape[0]})
-			self.graph.nodes['note'].data['feature'] = note_node_features.float()
-			self.graph.nodes['note'].data['labels'] = note_node_labels
-			self.graph.nodes['rest'].data['feature'] = rest_node_features.float()
-			self.graph.nodes['rest'].data['labels'] = rest_node_labels
+		# Every task is (piece, location, files, note columns, augmentation seed).
+		tasks = piece_tasks(self.url, self.raw_dir, self.select_piece, self.storage, self.aug_seed)
+		# Collect every piece (and augmented copy) first and batch once, in the same order as the pieces are read.
+		graphs = list()
+		self.graph_pieces = list()
+		timings = dict()
+		# Compact graphs get their inverse relations after batching.
+		build_inverse_edges = self.add_inverse_edges and self.compact is None
+		if self.incremental:
+			all_piece_graphs = self.build_incremental(tasks, build_inverse_edges, timings)
 		else:
-			if 'mozart' in self.raw_dir : 
-				print(self.raw_dir)    
-				if all([os.path.isdir(os.path.join(self.raw_dir, fn)) for fn in os.listdir(self.raw_dir)]):
-					for fn in os.listdir(self.raw_dir):
-						print(fn)
-						edge_dict = dict()
-						for csv in os.listdir(os.path.join(self.raw_dir, fn)):
-							if csv == "note.csv":
-								notes = pd.read_csv(os.path.join(self.raw_dir, fn, "note.csv"))
-								note_node_features = torch.from_numpy(notes[["onset", "duration", "pitch"]].to_numpy())
-								note_node_labels = torch.from_numpy(notes['label'].astype('category').cat.codes.to_numpy()).long()
-
-							elif csv == "rest.csv":      
-								rests = pd.read_csv(os.path.join(self.raw_dir, fn, "rest.csv"))
-								a = rests[["onset", "duration"]].to_numpy()
-								rest_node_features = torch.from_numpy(np.hstack((a,np.zeros((a.shape[0],1)))))
-								rest_node_labels = torch.from_numpy(rests['label'].astype('category').cat.codes.to_numpy()).long()
-							else :
-								name = tuple(csv.split(".")[0].split("-"))
-								edges_data = pd.read_csv(os.path.join(self.raw_dir, fn, csv)) 
-								if edges_data.empty:   
-									edges_src = torch.tensor([0])
-									edges_dst = torch.tensor([0])       				
-								else :
-									edges_src = torch.from_numpy(edges_data['src'].to_numpy())
-									edges_dst = torch.from_numpy(edges_data['des'].to_numpy())
-								edge_dict[name] = (edges_src, edges_dst)
-								if self.add_inverse_edges:
-									inv_name = (name[2], name[1]+"_inv", name[0])
-									edge_dict[inv_name] = (edges_dst, edges_src)
-
-
-						try:
-							g = self.graph
-							graph = dgl.heterograph(edge_dict, num_nodes_dict={"note" : notes.shape[0], "rest" :rests.shape[0]})
-							graph.nodes['note'].data['feature'] = note_node_features.float()
-							graph.nodes['note'].data['labels'] = note_node_labels
-							graph.nodes['rest'].data['feature'] = rest_node_features.float()
-							graph.nodes['rest'].data['labels'] = rest_node_labels
-							self.graph = dgl.batch_hetero([g, graph])
-						except AttributeError:
-							self.graph = dgl.heterograph(edge_dict, num_nodes_dict={"note" : notes.shape[0], "rest" : rests.shape[0]})
-							self.graph.nodes['note'].data['feature'] = note_node_features.float()
-							self.graph.nodes['note'].data['labels'] = note_node_labels
-							self.graph.nodes['rest'].data['feature'] = rest_node_features.float()
-							self.graph.nodes['rest'].data['labels'] = rest_node_labels
-			else:    
-
-				for fn in self.PIECE_LIST:
-					print(fn)
-					edge_dict = dict()
-					for csv in self.FILE_LIST:
-						path = self.url + "/" + fn + "/" + csv
-						if csv == "note.csv":
-							notes = pd.read_csv(path)
-							note_node_features = torch.from_numpy(notes[["onset", "duration", "ts", "pitch"]].to_numpy())
-							note_node_labels = torch.from_numpy(notes['label'].astype('category').cat.codes.to_numpy()).long()
-						elif csv == "rest.csv":      
-							rests = pd.read_csv(path)
-							a = rests[["onset", "duration", "ts"]].to_numpy()
-							rest_node_features = torch.from_numpy(np.hstack((a,np.zeros((a.shape[0],1)))))
-							rest_node_labels = torch.from_numpy(rests['label'].astype('category').cat.codes.to_numpy()).long()
-						else :
-							name = tuple(csv.split(".")[0].split("-"))
-							edges_data = pd.read_csv(path)
-							if edges_data.empty:   
-								edges_src = torch.tensor([0])
-								edges_dst = torch.tensor([0])       				
-							else :
-								edges_src = torch.from_numpy(edges_data['src'].to_numpy())
-								edges_dst = torch.from_numpy(edges_data['des'].to_numpy())
-							edge_dict[name] = (edges_src, edges_dst)
-							if self.add_inverse_edges:
-								inv_name = (name[2], name[1]+"_inv", name[0])
-								edge_dict[inv_name] = (edges_dst, edges_src)
-
-
-					try:
-						g = self.graph
-						
-						graph = dgl.heterograph(edge_dict, num_nodes_dict={"note" : notes.shape[0], "rest" :rests.shape[0]})
-						graph.nodes['note'].data['feature'] = note_node_features.float()
-						graph.nodes['note'].data['labels'] = note_node_labels
-						graph.nodes['rest'].data['feature'] = rest_node_features.float()
-						graph.nodes['rest'].data['labels'] = rest_node_labels
-						self.graph = dgl.batch_hetero([g, graph])
-					except AttributeError:
-						self.graph = dgl.heterograph(edge_dict, num_nodes_dict={"note" : notes.shape[0], "rest" : rests.shape[0]})
-						self.graph.nodes['note'].data['feature'] = note_node_features.float()
-						self.graph.nodes['note'].data['labels'] = note_node_labels
-						self.graph.nodes['rest'].data['feature'] = rest_node_features.float()
-						self.graph.nodes['rest'].data['labels'] = rest_node_labels
-
-
-					# Perform Data Augmentation
-					if self.add_aug:
-						for _ in range(5):
-							g = self.graph
-							resize_factor = random.choice([0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2, 2.5])
-							n = random.choice(range(-6, 6, 1))
-							if resize_factor != 1 or n != 0:
-								dur_resize = torch.tensor([resize_factor, resize_factor, resize_factor, 1]).float()
-								pitch_aug = torch.tensor([0, 0 , 0, n]).float()
-								graph = dgl.heterograph(edge_dict, num_nodes_dict={"note" : notes.shape[0], "rest" :rests.shape[0]})
-								graph.nodes['note'].data['feature'] = note_node_features.float()*dur_resize + pitch_aug
-								graph.nodes['note'].data['labels'] = note_node_labels
-								graph.nodes['rest'].data['feature'] = rest_node_features.float()
-								graph.nodes['rest'].data['labels'] = rest_node_labels
-								self.graph = dgl.batch_hetero([g, graph])
-
+			all_piece_graphs = build_piece_graphs(tasks, build_inverse_edges, self.num_workers, timings)
+		for stage, seconds in timings.items():
+			self.profiler.add("dataset/" + stage, seconds, len(tasks))
+		for i, (task, piece_graphs) in enumerate(zip(tasks, all_piece_graphs)):
+			print(task[0])
+			# Index of the piece of every node, shared by its augmented copies.
+			for graph in piece_graphs:
+				for ntype in graph.ntypes:
+					graph.nodes[ntype].data['piece'] = torch.full((graph.num_nodes(ntype),), i, dtype=torch.long)
+			if self.compact is not None:
+				piece_graphs = [compact_graph(graph, COMPACT_DTYPES[self.compact]) for graph in piece_graphs]
+			graphs.extend(piece_graphs)
+			self.graph_pieces.extend([i] * len(piece_graphs))
+		self.pieces = [task[0] for task in tasks]
+		self.predict_category = "note"
+		if self.multi_graph:
+			if self.compact is not None and self.add_inverse_edges:
+				graphs = [add_inverse_relations(graph) for graph in graphs]
+			self.graphs = graphs
+			self.num_classes = int(max(graph.nodes['note'].data['labels'].max().item() for graph in graphs) + 1)
+			return
+		with self.profiler.section("dataset/batch"):
+			self.graph = dgl.batch(graphs)
+			del graphs
+			if self.compact is not None and self.add_inverse_edges:
+				self.graph = add_inverse_relations(self.graph)
 
 		# If your dataset is a node classification dataset, you will need to assign
 		# masks indicating whether a node belongs to training, validation, and test set.
 		self.num_classes = int(self.graph.nodes['note'].data['labels'].max().item() + 1)
-		self.predict_category = "note"
 		n_nodes = self.graph.num_nodes("note")
 		n_train = int(n_nodes * 0.8)
 
@@ -204,26 +687,199 @@ class MozartPianoGraphDataset(DGLDataset):
 		self.graph.nodes['rest'].data['train_mask'] = train_mask
 		self.graph.nodes['rest'].data['test_mask'] = test_mask
 
+	def build_incremental(self, tasks, add_inverse_edges=False, timings=None):
+		"""
+		Like ``build_piece_graphs``, but reuse the cached graphs of the local pieces whose files did not change.
+
+		The pieces read from an url, and every piece with ``force_reload``, are always built.
+		"""
+		manifest = self.load_manifest()
+		entries = dict()
+		rebuild = list()
+		for task in tasks:
+			piece, location = task[0], task[1]
+			if not os.path.isdir(location):
+				rebuild.append(task)
+				continue
+			old = manifest.get(piece)
+			files = piece_fingerprint(location, old["files"] if old else None)
+			entries[piece] = {"files": files}
+			if self._force_reload or not (old is not None and _same_content(files, old["files"]) and os.path.exists(self.piece_graph_path(piece))):
+				rebuild.append(task)
+		built = dict(zip([task[0] for task in rebuild], build_piece_graphs(rebuild, add_inverse_edges, self.num_workers, timings)))
+		print("Rebuilt {} of {} pieces".format(len(rebuild), len(tasks)))
+
+		os.makedirs(os.path.dirname(self.piece_graph_path("")), exist_ok=True)
+		all_piece_graphs = list()
+		for task in tasks:
+			piece = task[0]
+			if piece in built:
+				if piece in entries:
+					dgl.save_graphs(self.piece_graph_path(piece), built[piece])
+				all_piece_graphs.append(built[piece])
+			else:
+				all_piece_graphs.append(dgl.load_graphs(self.piece_graph_path(piece))[0])
+		# drop the pieces removed from raw_dir, not the ones this run did not select
+		current = self.piece_names(self.url, self.raw_dir, None, self.storage) if os.path.isdir(self.raw_dir) else []
+		for piece in set(manifest) - set(current):
+			del manifest[piece]
+			if os.path.exists(self.piece_graph_path(piece)):
+				os.remove(self.piece_graph_path(piece))
+		manifest.update(entries)
+		self.save_manifest(manifest)
+		return all_piece_graphs
+
+	@property
+	def piece_hash(self):
+		"""
+		The hash of the dataset settings, without the piece list, keying the per-piece cache.
+		"""
+		key = (self.url, self.raw_dir, self.storage, self.add_inverse_edges, self.add_aug, self.lazy_aug, self.seed, self.compact)
+		return hashlib.sha1(str(key).encode("utf-8")).hexdigest()[:8]
+
+	@property
+	def manifest_path(self):
+		return os.path.join(self.save_dir, self.name, "manifest_{}.json".format(self.piece_hash))
+
+	def piece_graph_path(self, piece):
+		return os.path.join(self.save_dir, self.name, "pieces_{}".format(self.piece_hash), piece + ".bin")
+
+	def load_manifest(self):
+		"""
+		The per-piece file fingerprints of the last incremental process(), empty without one.
+		"""
+		if not os.path.exists(self.manifest_path):
+			return dict()
+		with open(self.manifest_path) as f:
+			return json.load(f)
+
+	def piece_manifest(self):
+		"""
+		The manifest entries of the dataset pieces, e.g. only the selected piece of a ``select_piece`` dataset.
+		"""
+		manifest = self.load_manifest()
+		return {piece: manifest[piece] for piece in self.pieces if piece in manifest}
+
+	def save_manifest(self, entries):
+		os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+		with open(self.manifest_path, "w") as f:
+			json.dump(entries, f)
+
+	def pieces_changed(self, manifest=None):
+		"""
+		Whether a local piece folder of the dataset was added, removed or has files with a new size or mtime
+		since ``manifest``, by default the entries of the dataset pieces in the manifest of the per-piece cache.
+		"""
+		if self.storage != "npy" and (self.select_piece in PIECE_LIST or 'mozart' not in self.raw_dir):
+			return False
+		names = self.piece_names(self.url, self.raw_dir, self.select_piece, self.storage)
+		if manifest is None:
+			manifest = {piece: entry for piece, entry in self.load_manifest().items() if piece in names}
+		if sorted(names) != sorted(manifest):
+			return True
+		return not all(_same_stat(os.path.join(self.raw_dir, piece), manifest[piece]["files"]) for piece in names)
+
 	def __getitem__(self, i):
+		if self.multi_graph:
+			return self.graphs[i]
 		return self.graph
 
 	def __len__(self):
+		if self.multi_graph:
+			return len(self.graphs)
 		return 1
 
+	def piece_split(self, fractions, seed=0):
+		"""
+		Split the graphs by piece, so that the augmented copies of a piece stay in the same part.
+
+		Parameters
+		----------
+		fractions : list
+			The fraction of the pieces in every part, e.g. ``(0.8, 0.2)``.
+		seed : int
+			The seed of the piece shuffling.
+
+		Returns
+		-------
+		parts : list
+			For every fraction, the list of its graph indices.
+		"""
+		part_of_piece = piece_parts(len(self.pieces), fractions, seed)
+		parts = [list() for _ in fractions]
+		for i, p in enumerate(self.graph_pieces):
+			if p in part_of_piece:
+				parts[part_of_piece[p]].append(i)
+		return parts
+
+	def piece_folds(self, k, seed=0):
+		"""
+		Split the graphs into ``k`` cross-validation folds of pieces, with the augmented copies of a piece in its fold.
+
+		Returns
+		-------
+		folds : list
+			For every fold, the list of its graph indices.
+		"""
+		if k < 2 or k > len(self.pieces):
+			raise ValueError("The number of folds must be between 2 and the {} pieces, got {}".format(len(self.pieces), k))
+		return self.piece_split([1. / k] * k, seed)
+
+	@property
+	def graph_path(self):
+		return os.path.join(self.save_path, "graph_{}.bin".format(self.hash))
+
+	@property
+	def info_path(self):
+		return os.path.join(self.save_path, "info_{}.pkl".format(self.hash))
+
+	def has_cache(self):
+		if not (os.path.exists(self.graph_path) and os.path.exists(self.info_path)):
+			return False
+		if self.incremental:
+			# The manifest is shared with the other dataset modes and may be newer than this cache,
+			# compare against the fingerprints this cache was built from.
+			files = load_info(self.info_path).get("files")
+			if files is None or self.pieces_changed(files):
+				return False
+		return True
+
+	def save(self):
+		os.makedirs(self.save_path, exist_ok=True)
+		dgl.save_graphs(self.graph_path, self.graphs if self.multi_graph else [self.graph])
+		save_info(self.info_path, {
+			"num_classes": self.num_classes, "predict_category": self.predict_category,
+			"pieces": self.pieces, "graph_pieces": self.graph_pieces,
+			"files": self.piece_manifest() if self.incremental else None})
+
 	def load(self):
-		pass
+		with self.profiler.section("dataset/load_cache"):
+			graphs, _ = dgl.load_graphs(self.graph_path)
+		if self.multi_graph:
+			self.graphs = graphs
+		else:
+			self.graph = graphs[0]
+		info = load_info(self.info_path)
+		self.num_classes = info["num_classes"]
+		self.predict_category = info["predict_category"]
+		self.pieces = info["pieces"]
+		self.graph_pieces = info["graph_pieces"]
 
 
 class MPGD_cad(MozartPianoGraphDataset):
-	def __init__(self, raw_dir=None, add_inverse_edges=False, add_aug=True, select_piece=None):
-		url = "https://raw.githubusercontent.com/melkisedeath/tonnetzcad/main/node_classification/mps_ts_att_cadlab"
-		super().__init__(name='mpgd_cad', url=url)
+	def __init__(self, raw_dir=None, save_dir=None, add_inverse_edges=False, add_aug=True, lazy_aug=False, select_piece=None, multi_graph=False, storage="csv", seed=0, num_workers=0, profiler=None, compact=None, incremental=False, force_reload=False, verbose=False):
+		url = CAD_URL
+		super().__init__(
+			name='mpgd_cad', url=url, raw_dir=raw_dir, save_dir=save_dir, add_inverse_edges=add_inverse_edges,
+			add_aug=add_aug, lazy_aug=lazy_aug, select_piece=select_piece, multi_graph=multi_graph, storage=storage, seed=seed, num_workers=num_workers, profiler=profiler, compact=compact, incremental=incremental, force_reload=force_reload, verbose=verbose)
 
 
 class MPGD_onset(MozartPianoGraphDataset):
-	def __init__(self, raw_dir=None, add_inverse_edges=False, add_aug=True, select_piece=None):
-		url = "https://raw.githubusercontent.com/melkisedeath/tonnetzcad/main/node_classification/mps_ts_att_onlab/"
-		super().__init__(name='mpgd_onset', url=url)
+	def __init__(self, raw_dir=None, save_dir=None, add_inverse_edges=False, add_aug=True, lazy_aug=False, select_piece=None, multi_graph=False, storage="csv", seed=0, num_workers=0, profiler=None, compact=None, incremental=False, force_reload=False, verbose=False):
+		url = ONSET_URL
+		super().__init__(
+			name='mpgd_onset', url=url, raw_dir=raw_dir, save_dir=save_dir, add_inverse_edges=add_inverse_edges,
+			add_aug=add_aug, lazy_aug=lazy_aug, select_piece=select_piece, multi_graph=multi_graph, storage=storage, seed=seed, num_workers=num_workers, profiler=profiler, compact=compact, incremental=incremental, force_reload=force_reload, verbose=verbose)
 
 
 
@@ -0,0 +1,112 @@
+"""Onset window partitioning of piece graphs.
+
+A piece graph is cut into windows of consecutive onsets. Every window keeps the
+nodes starting in it (its core) and the nodes starting up to a halo before or
+after it (context), with the edges between them. Every node is in the core of
+exactly one window, so the windows can be trained and scored independently and
+their core predictions stitched back into predictions of the whole piece.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import torch
+import dgl
+
+
+def onset_windows(graph, window, halo=0., category="note", onset_column=0):
+	"""
+	Cut a piece graph into overlapping onset windows.
+
+	Parameters
+	----------
+	graph : dgl object
+		A piece heterograph with the onset in the ``onset_column`` of the 'feature' of every node type.
+	window : float
+		The onset length of the windows.
+	halo : float
+		The onset length of the context added before and after every window.
+	category : str
+		The node type to classify. Windows without core nodes of this type are dropped.
+	onset_column : int
+		The onset column of the node features.
+
+	Returns
+	-------
+	windows : list
+		The window subgraphs, in onset order. Their nodes keep the data of ``graph``, their
+		ids in ``graph`` as ``dgl.NID`` and a boolean 'core' marking the nodes starting in the window.
+	"""
+	if window <= 0:
+		raise ValueError("The window length must be positive, got {}".format(window))
+	onsets = {nt: graph.nodes[nt].data['feature'][:, onset_column].float() for nt in graph.ntypes}
+	sorted_onsets = {nt: torch.sort(onset) for nt, onset in onsets.items()}
+	present = [onset for onset in onsets.values() if len(onset) > 0]
+	if not present:
+		return []
+	start = min(onset.min().item() for onset in present)
+	end = max(onset.max().item() for onset in present)
+
+	windows = list()
+	lo = start
+	while lo <= end:
+		hi = lo + window
+		nodes, core = dict(), dict()
+		for nt, (values, order) in sorted_onsets.items():
+			# Nodes sorted by onset: the window and its halo are a contiguous range.
+			first = torch.searchsorted(values, torch.tensor([lo - halo]), right=False).item()
+			last = torch.searchsorted(values, torch.tensor([hi + halo]), right=False).item()
+			ids = torch.sort(order[first:last])[0]
+			nodes[nt] = ids.to(graph.idtype)
+			core[nt] = (onsets[nt][ids] >= lo) & (onsets[nt][ids] < hi)
+		if core[category].any():
+			sub = dgl.node_subgraph(graph, nodes)
+			for nt in sub.ntypes:
+				sub.nodes[nt].data['core'] = core[nt]
+			windows.append(sub)
+		lo = hi
+	return windows
+
+
+def partition_graphs(graphs, window, halo=0., category="note", onset_column=0):
+	"""
+	The onset windows of many piece graphs.
+
+	Returns
+	-------
+	windows : list
+		The windows of every graph, in the order of ``graphs``.
+	owners : list
+		For every window, the index of its graph in ``graphs``.
+	"""
+	windows, owners = list(), list()
+	for i, graph in enumerate(graphs):
+		graph_windows = onset_windows(graph, window, halo, category, onset_column)
+		windows.extend(graph_windows)
+		owners.extend([i] * len(graph_windows))
+	return windows, owners
+
+
+def stitch(windows, outputs, num_nodes, category="note"):
+	"""
+	The outputs of the ``category`` nodes of a whole graph from the outputs of its windows.
+
+	Every node takes the output of the window where it is a core node, the outputs of the halo nodes are dropped.
+
+	Parameters
+	----------
+	windows : list
+		The windows of one graph, as returned by ``onset_windows``.
+	outputs : list
+		For every window, the ``(num_window_nodes, ...)`` tensor of its ``category`` nodes.
+	num_nodes : int
+		The number of ``category`` nodes of the whole graph.
+
+	Returns
+	-------
+	output : tensor
+		The ``(num_nodes, ...)`` stitched outputs.
+	"""
+	stitched = outputs[0].new_zeros((num_nodes,) + tuple(outputs[0].shape[1:]))
+	for sub, output in zip(windows, outputs):
+		core = sub.nodes[category].data['core']
+		stitched[sub.nodes[category].data[dgl.NID][core].long()] = output[core]
+	return stitched
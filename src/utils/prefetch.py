@@ -0,0 +1,172 @@
+"""Streaming piece graphs to the training loop with background prefetching.
+
+A producer thread reads, builds and augments the upcoming pieces, in a pool of
+worker processes kept for every pass when ``num_workers > 0``, and puts batched graphs in a bounded queue
+while the consumer trains on the current batch. Only the queued batches and the
+pieces in flight are held in memory, so the corpus never has to fit in RAM.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import itertools
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import dgl
+
+from .nc_dataset_class import COMPACT_DTYPES, _init_worker, _load_task, add_inverse_relations, compact_graph
+
+
+_DONE = object()
+
+
+class PiecePipeline(object):
+	"""
+	An iterable of batched piece graphs built in the background, one pass over the pieces per iteration.
+
+	The worker processes are forked from the consumer thread on the first pass and reused by the next ones,
+	``close`` shuts them down.
+
+	Parameters
+	----------
+	tasks : list
+		The ``(piece, location, file_list, note_columns, aug_seed)`` tasks of the pieces, see ``piece_tasks``.
+	batch_size : int
+		The number of graphs (pieces and augmented copies) per batch.
+	num_workers : int
+		The number of processes building pieces, 0 to build them in the producer thread.
+	prefetch : int
+		The maximum number of batches waiting in the queue.
+	add_inverse_edges : bool
+		Add a reversed ``<rel>_inv`` relation for every relation.
+	compact : str
+		Store the graphs with int32 ids and 'float16' or 'bfloat16' features, see ``MozartPianoGraphDataset``.
+	shuffle : bool
+		Read the pieces in a new random order every pass.
+	seed : int
+		The seed of the piece order.
+
+	Attributes
+	----------
+	wait_seconds : float
+		The time the consumer waited for batches during the last pass.
+	build_seconds : dict
+		The seconds spent in the 'parse', 'build' and 'augment' stages during the last pass, summed over the workers.
+	num_batches : int
+		The number of batches of the last pass.
+	"""
+	def __init__(self, tasks, batch_size=8, num_workers=0, prefetch=4, add_inverse_edges=False, compact=None, shuffle=False, seed=0):
+		self.tasks = list(tasks)
+		self.batch_size = batch_size
+		self.num_workers = num_workers
+		self.prefetch = prefetch
+		self.add_inverse_edges = add_inverse_edges
+		self.compact = compact
+		self.shuffle = shuffle
+		self.seed = seed
+		self.epoch = 0
+		self.wait_seconds = 0.
+		self.build_seconds = dict()
+		self.num_batches = 0
+		self._pool = ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker) if num_workers > 0 else None
+
+	def close(self):
+		"""
+		Shut down the worker processes.
+		"""
+		if self._pool is not None:
+			self._pool.shutdown(wait=True, cancel_futures=True)
+			self._pool = None
+
+	def _submit(self, i):
+		# Compact graphs get their inverse relations after compaction.
+		task = tuple(self.tasks[i]) + (self.add_inverse_edges and self.compact is None,)
+		return self._pool.submit(_load_task, task) if self._pool is not None else task
+
+	def __iter__(self):
+		order = list(range(len(self.tasks)))
+		if self.shuffle:
+			random.Random("{}-{}".format(self.seed, self.epoch)).shuffle(order)
+		self.epoch += 1
+		self.wait_seconds = 0.
+		self.build_seconds = dict()
+		self.num_batches = 0
+		# At most two pieces per worker in flight, the first ones submitted from this thread,
+		# so that the pool forks its workers from the consumer rather than from the producer thread.
+		upcoming = iter(order)
+		pending = deque((i, self._submit(i)) for i in itertools.islice(upcoming, 2 * max(self.num_workers, 1)))
+		batches = queue.Queue(maxsize=self.prefetch)
+		stop = threading.Event()
+		producer = threading.Thread(target=self._produce, args=(upcoming, pending, batches, stop), daemon=True)
+		producer.start()
+		try:
+			while True:
+				t0 = time.perf_counter()
+				item = batches.get()
+				self.wait_seconds += time.perf_counter() - t0
+				if item is _DONE:
+					return
+				if isinstance(item, BaseException):
+					raise item
+				self.num_batches += 1
+				yield item
+		finally:
+			# Unblock and stop the producer when the consumer stops early.
+			stop.set()
+			while producer.is_alive():
+				try:
+					batches.get(timeout=0.1)
+				except queue.Empty:
+					pass
+			producer.join()
+
+	def _put(self, batches, item, stop):
+		while not stop.is_set():
+			try:
+				batches.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def _graphs(self, i, result):
+		graphs, timings = result
+		for stage, seconds in timings.items():
+			self.build_seconds[stage] = self.build_seconds.get(stage, 0.) + seconds
+		for graph in graphs:
+			# Index of the piece of every node, shared by its augmented copies.
+			for ntype in graph.ntypes:
+				graph.nodes[ntype].data['piece'] = torch.full((graph.num_nodes(ntype),), i, dtype=torch.long)
+		if self.compact is not None:
+			graphs = [compact_graph(graph, COMPACT_DTYPES[self.compact]) for graph in graphs]
+			if self.add_inverse_edges:
+				graphs = [add_inverse_relations(graph) for graph in graphs]
+		return graphs
+
+	def _produce(self, upcoming, pending, batches, stop):
+		try:
+			batch = list()
+			while pending and not stop.is_set():
+				i, job = pending.popleft()
+				result = job.result() if self._pool is not None else _load_task(job)
+				nxt = next(upcoming, None)
+				if nxt is not None:
+					pending.append((nxt, self._submit(nxt)))
+				batch.extend(self._graphs(i, result))
+				if len(batch) >= self.batch_size:
+					if not self._put(batches, dgl.batch(batch), stop):
+						return
+					batch = list()
+			if batch and not self._put(batches, dgl.batch(batch), stop):
+				return
+			self._put(batches, _DONE, stop)
+		except BaseException as e:
+			self._put(batches, e, stop)
+		finally:
+			# The pieces of an interrupted pass are not needed by the next one.
+			if self._pool is not None:
+				for _, job in pending:
+					job.cancel()
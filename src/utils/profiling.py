@@ -0,0 +1,191 @@
+"""Opt-in timing of the dataset build and of the training loop.
+
+Reference repo : https://github.com/melkisedeath/musym-GDL
+"""
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import torch
+
+
+class _NullSection(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class NullProfiler(object):
+	"""
+	The disabled profiler: every method is a no-op.
+	"""
+	enabled = False
+
+	def section(self, name):
+		return _NULL_SECTION
+
+	def iterate(self, iterable, name):
+		return iterable
+
+	def add(self, name, seconds, calls=1):
+		pass
+
+	def attach(self, model):
+		pass
+
+	def detach(self):
+		pass
+
+	def flush(self, **fields):
+		pass
+
+	def close(self):
+		pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler(NullProfiler):
+	"""
+	Opt-in wall clock timing of named sections, written as one JSON line per ``flush``.
+
+	Sections are accumulated between flushes, e.g. over an epoch. ``attach`` adds forward hooks
+	timing every ``HeteroGraphConv`` layer of a model and every relation module inside it.
+
+	Parameters
+	----------
+	path : str
+		The JSON lines output file, stdout if None.
+	cuda_sync : bool
+		Synchronize CUDA around every timed section, for exact GPU timings.
+	record_functions : bool
+		Also label every section in a torch profiler trace, see ``torch_trace``.
+	"""
+	enabled = True
+
+	def __init__(self, path=None, cuda_sync=False, record_functions=False):
+		self.path = path
+		self.record_functions = record_functions
+		self.file = open(path, "a") if path is not None else None
+		self.cuda_sync = cuda_sync and torch.cuda.is_available()
+		self.seconds = defaultdict(float)
+		self.calls = defaultdict(int)
+		self._handles = list()
+		self._starts = dict()
+
+	def _now(self):
+		if self.cuda_sync:
+			torch.cuda.synchronize()
+		return time.perf_counter()
+
+	@contextmanager
+	def section(self, name):
+		t0 = self._now()
+		try:
+			if self.record_functions:
+				with torch.autograd.profiler.record_function(name):
+					yield
+			else:
+				yield
+		finally:
+			self.add(name, self._now() - t0)
+
+	def iterate(self, iterable, name):
+		"""
+		Yield from ``iterable``, timing every fetch as section ``name``, e.g. the batches of a data loader.
+		"""
+		iterator = iter(iterable)
+		while True:
+			with self.section(name):
+				try:
+					item = next(iterator)
+				except StopIteration:
+					return
+			yield item
+
+	def add(self, name, seconds, calls=1):
+		self.seconds[name] += seconds
+		self.calls[name] += calls
+
+	def _pre_hook(self, name):
+		def hook(module, inputs):
+			self._starts.setdefault(name, []).append(self._now())
+		return hook
+
+	def _post_hook(self, name):
+		def hook(module, inputs, output):
+			self.add(name, self._now() - self._starts[name].pop())
+		return hook
+
+	def _relation_post_hook(self, layer, name):
+		def hook(module, inputs, output):
+			# a relation module can be shared by several canonical relations, e.g. 'follows'
+			etypes = inputs[0].canonical_etypes
+			section = "{}/{}".format(layer, "-".join(etypes[0])) if len(etypes) == 1 else name
+			self.add(section, self._now() - self._starts[name].pop())
+		return hook
+
+	def attach(self, model):
+		"""
+		Time the forward of every layer of ``model.layers`` as ``layer<i>``, and of the per-relation
+		modules of a ``HeteroGraphConv`` layer per canonical relation as ``layer<i>/<src>-<rel>-<dst>``.
+		"""
+		for i, layer in enumerate(model.layers):
+			name = "layer{}".format(i)
+			self._handles.append(layer.register_forward_pre_hook(self._pre_hook(name)))
+			self._handles.append(layer.register_forward_hook(self._post_hook(name)))
+			for rel, mod in getattr(layer, "mods", dict()).items():
+				mod_name = "{}/{}".format(name, rel)
+				self._handles.append(mod.register_forward_pre_hook(self._pre_hook(mod_name)))
+				self._handles.append(mod.register_forward_hook(self._relation_post_hook(name, mod_name)))
+
+	def detach(self):
+		for handle in self._handles:
+			handle.remove()
+		self._handles = list()
+
+	def flush(self, **fields):
+		"""
+		Write the accumulated sections with the extra ``fields`` (e.g. the epoch and metrics) and reset them.
+		"""
+		record = dict(fields)
+		record["seconds"] = {k: round(v, 6) for k, v in self.seconds.items()}
+		record["calls"] = dict(self.calls)
+		line = json.dumps(record)
+		if self.file is not None:
+			self.file.write(line + "\n")
+			self.file.flush()
+		else:
+			print(line)
+		self.seconds.clear()
+		self.calls.clear()
+
+	def close(self):
+		self.detach()
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+
+@contextmanager
+def torch_trace(path=None):
+	"""
+	Record a torch profiler trace of the enclosed code and export it to ``path`` as a chrome trace.
+
+	Nothing is recorded if ``path`` is None.
+	"""
+	if path is None:
+		yield None
+		return
+	activities = [torch.profiler.ProfilerActivity.CPU]
+	if torch.cuda.is_available():
+		activities.append(torch.profiler.ProfilerActivity.CUDA)
+	with torch.profiler.profile(activities=activities) as prof:
+		yield prof
+	prof.export_chrome_trace(path)
@@ -0,0 +1,48 @@
+"""
+Convert piece CSVs to the columnar ``.npy`` layout read by ``MozartPianoGraphDataset(storage="npy")``.
+
+Run from ``src`` :
+
+	python -m utils.to_columnar --src <url or folder> --dst <folder>
+"""
+import argparse
+import os
+from .nc_dataset_class import PIECE_LIST, FILE_LIST, read_piece, save_columnar_piece
+
+
+def convert_corpus(src, dst, pieces=PIECE_LIST, note_columns=("onset", "duration", "ts", "pitch")):
+	"""
+	Convert every piece folder ``src/<piece>`` to ``dst/<piece>``.
+
+	Parameters
+	----------
+	src : str
+		The folder or url holding the piece CSV folders.
+	dst : str
+		The output folder.
+	pieces : list
+		The pieces to convert.
+	note_columns : list
+		The note feature columns to keep.
+	"""
+	for fn in pieces:
+		print(fn)
+		piece = read_piece(src + "/" + fn, FILE_LIST, list(note_columns))
+		save_columnar_piece(piece, os.path.join(dst, fn))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Convert piece CSVs to columnar npy arrays')
+	parser.add_argument("--src", type=str, required=True,
+			help="folder or url of the piece CSV folders")
+	parser.add_argument("--dst", type=str, required=True,
+			help="output folder")
+	parser.add_argument("--pieces", type=str, nargs='+', default=None,
+			help="pieces to convert, default: PIECE_LIST, or every folder of a local --src")
+	parser.add_argument("--note-columns", type=str, nargs='+', default=["onset", "duration", "ts", "pitch"],
+			help="note feature columns")
+	args = parser.parse_args()
+	pieces = args.pieces
+	if pieces is None:
+		pieces = sorted(os.listdir(args.src)) if os.path.isdir(args.src) else PIECE_LIST
+	convert_corpus(args.src, args.dst, pieces, args.note_columns)